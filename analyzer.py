@@ -0,0 +1,140 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    analyzer.py                                        :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 21:05:14 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 21:05:14 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Text analysis shared by the indexer and the search engine.
+
+Text is lowercased, punctuation is removed ("light-up" -> "lightup",
+"web-scraping.dev" -> "webscrapingdev") and it is split on whitespace; the
+terms are optionally stemmed, and analyze() drops stopwords. The prebuilt
+indexes of fichier_prof/ have the same kind of terms.
+
+create_index.run records the analyzer it used (Analyzer.metadata) next to
+the indexes, and SearchEngine analyzes queries with the same settings.
+"""
+
+import string
+from typing import Dict, Iterable, List, Optional
+
+# Bumped whenever a change makes the terms of a text differ
+ANALYZER_VERSION = 1
+
+STOPWORDS = frozenset({
+    "i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you", "your",
+    "yours", "yourself", "yourselves", "he", "him", "his", "himself", "she",
+    "her", "hers", "herself", "it", "its", "itself", "they", "them", "their",
+    "theirs", "themselves", "what", "which", "who", "whom", "this", "that",
+    "these", "those", "am", "is", "are", "was", "were", "be", "been", "being",
+    "have", "has", "had", "having", "do", "does", "did", "doing", "a", "an",
+    "the", "and", "but", "if", "or", "because", "as", "until", "while", "of",
+    "at", "by", "for", "with", "about", "against", "between", "into", "through",
+    "during", "before", "after", "above", "below", "to", "from", "up", "down",
+    "in", "out", "on", "off", "over", "under", "again", "further", "then",
+    "once", "here", "there", "when", "where", "why", "how", "all", "any",
+    "both", "each", "few", "more", "most", "other", "some", "such", "no",
+    "nor", "not", "only", "own", "same", "so", "than", "too", "very", "s",
+    "t", "can", "will", "just", "don", "should", "now"
+})
+
+# Built once: deletes punctuation
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# Separates the texts of a batch; removed from the texts themselves
+_BATCH_SEPARATOR = "\x00"
+
+
+def s_stem(term: str) -> str:
+    """
+    Harman's S-stemmer: only plural endings are removed
+    ("candies" -> "candy", "shoes" -> "shoe", "boots" -> "boot").
+    """
+    if len(term) <= 3 or term[-1] != "s":
+        return term
+    if term.endswith("ies") and not term.endswith(("eies", "aies")):
+        return term[:-3] + "y"
+    if term.endswith("es") and not term.endswith(("aes", "ees", "oes")):
+        return term[:-1]
+    if not term.endswith(("us", "ss")):
+        return term[:-1]
+    return term
+
+
+class Analyzer:
+    """
+    Turns text into terms. stem=True applies s_stem to every term.
+    """
+
+    def __init__(self, stem: bool = False, stopwords: Iterable[str] = STOPWORDS):
+        self.stem = stem
+        self.stopwords = frozenset(stopwords)
+
+    @classmethod
+    def from_metadata(cls, metadata: Optional[Dict]) -> "Analyzer":
+        """
+        The analyzer described by metadata (default settings for None).
+        """
+        return cls(stem=bool(metadata and metadata.get("stemming")))
+
+    def metadata(self) -> Dict:
+        return {"analyzer_version": ANALYZER_VERSION, "stemming": self.stem}
+
+    def _terms(self, normalized: str) -> List[str]:
+        terms = normalized.split()
+        if self.stem:
+            terms = [s_stem(term) for term in terms]
+        return terms
+
+    def tokenize(self, text: Optional[str]) -> List[str]:
+        """
+        Every term of a text, stopwords included.
+        """
+        return self._terms(text.lower().translate(_PUNCTUATION_TABLE)) if text else []
+
+    def analyze(self, text: Optional[str]) -> List[str]:
+        """
+        Terms of a text without stopwords, in order: the indexed terms.
+        """
+        if not text:
+            return []
+        stopwords = self.stopwords
+        return [term for term in self._terms(text.lower().translate(_PUNCTUATION_TABLE))
+                if term not in stopwords]
+
+    def tokenize_many(self, texts: Iterable[Optional[str]]) -> List[List[str]]:
+        """
+        tokenize() of several texts, translated in one call.
+        """
+        joined = _BATCH_SEPARATOR.join(
+            (text or "").replace(_BATCH_SEPARATOR, " ") for text in texts)
+        normalized = joined.lower().translate(_PUNCTUATION_TABLE)
+        return [self._terms(part) for part in normalized.split(_BATCH_SEPARATOR)]
+
+    def analyze_many(self, texts: Iterable[Optional[str]]) -> List[List[str]]:
+        """
+        analyze() of several texts, translated in one call.
+        """
+        stopwords = self.stopwords
+        return [[term for term in terms if term not in stopwords] for terms in self.tokenize_many(texts)]
+
+
+DEFAULT_ANALYZER = Analyzer()
+
+
+def analyze(text: Optional[str]) -> List[str]:
+    """Terms of a text with the default analyzer."""
+    return DEFAULT_ANALYZER.analyze(text)
+
+
+def analyze_many(texts: Iterable[Optional[str]]) -> List[List[str]]:
+    """Terms of several texts with the default analyzer."""
+    return DEFAULT_ANALYZER.analyze_many(texts)
@@ -0,0 +1,385 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    benchmark.py                                       :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 19:48:36 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 19:48:36 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Reproducible benchmarks of the crawl, the index build and the search engine.
+
+For each catalog size a synthetic catalog is generated (same schema as
+products.jsonl, fixed seed) and:
+    index build  the phases of create_index.run are timed one by one
+    engine       SearchEngine startup time and peak memory, then the latency
+                 (p50/p95/p99) of every search type over a query log; this
+                 runs in a fresh process so that memory is the engine's own
+    crawl        crawler.crawl_concurrent against a local stub HTTP server
+
+Everything is written to one JSON file, tagged with the git commit, so that
+two commits can be compared:
+
+    python benchmark.py --docs 10000 100000 --output before.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows: peak memory is not reported
+    resource = None
+
+import create_index
+import crawler
+from index_format import DOC_TABLE_FILE
+from utils import RobotsCache
+
+SEARCH_TYPES = ('any', 'all', 'exact')
+
+# Vocabulary of the synthetic catalogs
+ADJECTIVES = ["classic", "premium", "light", "organic", "vintage", "sport", "soft", "compact",
+              "deluxe", "eco", "waterproof", "handmade", "wireless", "slim", "kids", "sweet"]
+COLORS = ["black", "white", "red", "blue", "green", "pink", "brown", "grey", "orange", "purple"]
+NOUNS = ["shirt", "sneakers", "sandals", "boots", "jacket", "hat", "chocolate", "candy", "tea",
+         "coffee", "cookies", "mug", "lamp", "backpack", "socks", "gloves", "potion", "scarf"]
+WORDS = ["comfort", "quality", "design", "durable", "perfect", "gift", "everyday", "taste",
+         "flavor", "fabric", "leather", "cotton", "natural", "fresh", "style", "warm", "box",
+         "crafted", "ingredients", "occasion", "family", "season", "travel", "outdoor", "care"]
+BRANDS = ["ChocoDelight", "TimelessFootwear", "GildedRose", "SunnyBrew", "UrbanThread",
+          "NordicHome", "PeakGear", "LittleSteps"]
+ORIGINS = ["USA", "France", "Spain", "Germany", "Italy", "South Korea", "Switzerland",
+           "Netherlands", "China", "Japan"]
+
+
+def zipf_choices(rng: random.Random, words: List[str], k: int) -> List[str]:
+    """k words drawn with a Zipf-like distribution: the first ones are frequent."""
+    return rng.choices(words, weights=[1 / rank for rank in range(1, len(words) + 1)], k=k)
+
+
+def generate_product(rng: random.Random, doc_id: int) -> Dict:
+    """One synthetic product with the fields of products.jsonl."""
+    noun = rng.choice(NOUNS)
+    title = f"{rng.choice(ADJECTIVES).title()} {rng.choice(COLORS).title()} {noun.title()}"
+    url = f"https://web-scraping.dev/product/{doc_id}"
+    if rng.random() < 0.2:
+        url += f"?variant={rng.choice(COLORS)}-{rng.randint(1, 9)}"
+    description = " ".join([noun, *zipf_choices(rng, WORDS + ADJECTIVES + COLORS, rng.randint(15, 45))])
+    reviews = [{"date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "rating": rng.randint(1, 5), "text": " ".join(zipf_choices(rng, WORDS, 8))}
+               for _ in range(rng.choice([0, 0, 1, 2, 3, 5, 8]))]
+    return {
+        "url": url,
+        "title": title,
+        "description": description.capitalize(),
+        "product_features": {"brand": rng.choice(BRANDS), "made in": rng.choice(ORIGINS),
+                             "material": rng.choice(WORDS)},
+        "links": [f"https://web-scraping.dev/product/{rng.randrange(doc_id + 1)}" for _ in range(3)],
+        "product_reviews": reviews,
+    }
+
+
+def generate_catalog(path: str, num_docs: int, seed: int = 0) -> None:
+    """Write num_docs synthetic products to a JSONL file."""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        for doc_id in range(num_docs):
+            f.write(json.dumps(generate_product(rng, doc_id)) + "\n")
+
+
+def generate_queries(num_queries: int, seed: int = 0) -> List[str]:
+    """A query log mixing one to three word queries, origins and full titles."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        kind = rng.random()
+        if kind < 0.5:
+            query = " ".join(zipf_choices(rng, NOUNS + COLORS + ADJECTIVES, rng.randint(1, 3)))
+        elif kind < 0.7:
+            query = f"{rng.choice(NOUNS)} made in {rng.choice(ORIGINS).lower()}"
+        elif kind < 0.9:
+            query = f"{rng.choice(ADJECTIVES)} {rng.choice(COLORS)} {rng.choice(NOUNS)}"
+        else:
+            query = f'"{rng.choice(COLORS)} {rng.choice(NOUNS)}"'
+        queries.append(query)
+    return queries
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Count, mean, p50, p95, p99 and max of latencies, in milliseconds."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))] * 1000
+
+    return {"count": len(ordered), "mean_ms": sum(ordered) / len(ordered) * 1000,
+            "p50_ms": rank(50), "p95_ms": rank(95), "p99_ms": rank(99), "max_ms": ordered[-1] * 1000}
+
+
+def peak_memory_mb() -> Optional[float]:
+    """Peak resident memory of this process, when the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_index_build(catalog_path: str, folder: str, workers: Optional[int] = None) -> Dict:
+    """
+    Time the steps of create_index.run on a catalog, writing binary indexes
+    to folder/index. Returns the duration of each step in seconds.
+    """
+    index_folder = os.path.join(folder, "index")
+    timings = {}
+
+    start = time.perf_counter()
+    data = list(create_index.iter_data(catalog_path))
+    timings["read_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    processed_data, documents = create_index.process_data(
+        data, os.path.join(folder, "processed_products.jsonl"), index_folder)
+    timings["process_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexes = create_index.build_indexes_parallel(processed_data, workers)
+    timings["build_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    create_index.save_indexes(indexes, documents, index_folder, "binary")
+    timings["save_s"] = time.perf_counter() - start
+
+    timings["total_s"] = sum(timings.values())
+    timings["workers"] = workers or os.cpu_count() or 1
+    return timings
+
+
+def prepare_engine_folder(folder: str) -> str:
+    """
+    Lay the indexes built by benchmark_index_build out as SearchEngine reads
+    them (the layout of fichier_prof/). Returns the index path.
+    """
+    index_folder = os.path.join(folder, "index")
+    engine_folder = os.path.join(folder, "engine") + os.sep
+    os.makedirs(engine_folder, exist_ok=True)
+    for source, target in (("index_title", "title_index"), ("index_description", "description_index"),
+                           ("index_brand", "brand_index"), ("index_made_in", "origin_index")):
+        shutil.copy(os.path.join(index_folder, f"{source}.bin"), f"{engine_folder}{target}.bin")
+    shutil.copy(os.path.join(index_folder, DOC_TABLE_FILE), engine_folder)
+    shutil.copy(os.path.join(folder, "processed_products.jsonl"), f"{engine_folder}rearranged_products.jsonl")
+    shutil.copy(os.path.join(index_folder, create_index.INDEX_META_FILE), engine_folder)
+    shutil.copy(os.path.join(index_folder, "index_lengths.json"), f"{engine_folder}lengths_index.json")
+    shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "fichier_prof", "origin_synonyms.json"),
+                engine_folder)
+    with open(f"{engine_folder}domain_index.json", "w") as f:
+        json.dump({}, f)
+
+    # The engine reads the mean rating under "mean_mark"
+    with open(os.path.join(index_folder, "index_reviews.json"), encoding="utf-8") as f:
+        reviews = json.load(f)
+    with open(f"{engine_folder}reviews_index.json", "w", encoding="utf-8") as f:
+        json.dump({url: {"total_reviews": stats["total_reviews"], "mean_mark": stats["average_rating"],
+                         "last_rating": stats["last_rating"]}
+                   for url, stats in reviews.items()}, f)
+    return engine_folder
+
+
+def benchmark_engine(index_path: str, queries: List[str], k: int = 10, warmup: int = 5) -> Dict:
+    """
+    Load a SearchEngine and time every query of the log once per search type
+    (result cache disabled). Meant to run in a fresh process.
+    """
+    from tp3 import SearchEngine
+    memory_before = peak_memory_mb()
+    start = time.perf_counter()
+    engine = SearchEngine(index_path, cache_size=0)
+    startup = time.perf_counter() - start
+    memory_after = peak_memory_mb()
+
+    latency = {}
+    for search_type in SEARCH_TYPES:
+        for query in queries[:warmup]:
+            engine.search(query, search_type, k=k)
+        durations = []
+        for query in queries:
+            start = time.perf_counter()
+            engine.search(query, search_type, k=k)
+            durations.append(time.perf_counter() - start)
+        latency[search_type] = percentiles(durations)
+
+    return {
+        "documents": len(engine.doc_ids),
+        "startup_s": startup,
+        "peak_memory_mb": memory_after,
+        "engine_memory_mb": memory_after - memory_before if memory_after is not None else None,
+        "k": k,
+        "latency": latency,
+    }
+
+
+def benchmark_engine_in_process(index_path: str, queries: List[str], k: int = 10) -> Dict:
+    """benchmark_engine in a new interpreter, so that memory is measured from scratch."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(benchmark_engine, (index_path, queries, k))
+
+
+class StubSiteHandler(BaseHTTPRequestHandler):
+    """
+    A small shop: /products lists every product page, each product page links
+    to a few others. robots.txt allows everything without a Crawl-delay.
+    """
+    num_products = 100
+
+    def do_GET(self):
+        if self.path == "/robots.txt":
+            self._send("text/plain", "User-agent: *\nAllow: /\n")
+        elif self.path == "/products":
+            links = "".join(f'<a href="/product/{i}">Product {i}</a>' for i in range(self.num_products))
+            self._send("text/html", f"<html><head><title>Products</title></head><body>"
+                                    f"<p>All products</p>{links}</body></html>")
+        elif self.path.startswith("/product/"):
+            product_id = int(self.path.rsplit("/", 1)[1])
+            rng = random.Random(product_id)
+            product = generate_product(rng, product_id)
+            links = "".join(f'<a href="/product/{rng.randrange(self.num_products)}">related</a>' for _ in range(5))
+            self._send("text/html", f"<html><head><title>{product['title']}</title></head><body>"
+                                    f"<p>web-scraping.dev</p><p class=\"product-description\">"
+                                    f"{product['description']}</p>{links}</body></html>")
+        else:
+            self.send_error(404)
+
+    def _send(self, content_type: str, body: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def benchmark_crawl(folder: str, pages: int = 100, workers: int = 8) -> Dict:
+    """
+    Crawl `pages` pages of a local stub site with crawler.crawl_concurrent
+    (no politeness delay). The sequential crawl sleeps 5 s per page and is
+    not benchmarked.
+    """
+    handler = type("Handler", (StubSiteHandler,), {"num_products": pages})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        start_url = f"http://127.0.0.1:{server.server_address[1]}/products"
+        output_file = os.path.join(folder, "crawled_webpages.jsonl")
+        start = time.perf_counter()
+        crawler.crawl_concurrent(start_url, max_urls=pages, workers=workers, default_delay=0,
+                                 robots_cache=RobotsCache(), output_file=output_file)
+        duration = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    with open(output_file, encoding="utf-8") as f:
+        crawled = sum(1 for _ in f)
+    return {"pages": crawled, "workers": workers, "total_s": duration,
+            "pages_per_s": crawled / duration if duration else None}
+
+
+def run(doc_counts: List[int], num_queries: int = 200, k: int = 10, workers: Optional[int] = None,
+        crawl_pages: int = 100, crawl_workers: int = 8, seed: int = 0,
+        workdir: Optional[str] = None) -> Dict:
+    """
+    Run every benchmark and return the results. Generated files go to
+    workdir (a temporary directory, removed afterwards, by default).
+    """
+    queries = generate_queries(num_queries, seed)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {"doc_counts": doc_counts, "num_queries": num_queries, "k": k, "seed": seed},
+        "catalogs": [],
+    }
+
+    root = workdir or tempfile.mkdtemp(prefix="benchmark_")
+    try:
+        for num_docs in doc_counts:
+            folder = os.path.join(root, f"catalog_{num_docs}")
+            os.makedirs(folder, exist_ok=True)
+            catalog_path = os.path.join(folder, "products.jsonl")
+            print(f"Catalog of {num_docs} products...")
+            generate_catalog(catalog_path, num_docs, seed)
+
+            index_build = benchmark_index_build(catalog_path, folder, workers)
+            print(f"  index build: {index_build['total_s']:.2f} s")
+            engine = benchmark_engine_in_process(prepare_engine_folder(folder), queries, k)
+            print(f"  engine startup: {engine['startup_s']:.2f} s, "
+                  + ", ".join(f"{search_type} p95 {stats['p95_ms']:.1f} ms"
+                              for search_type, stats in engine["latency"].items()))
+            results["catalogs"].append({"documents": num_docs, "index_build": index_build, "engine": engine})
+
+        if crawl_pages:
+            results["crawl"] = benchmark_crawl(root, crawl_pages, crawl_workers)
+            print(f"Crawl: {results['crawl']['pages_per_s']:.1f} pages/s")
+    finally:
+        if workdir is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--docs", type=int, nargs="+", default=[10000], help="catalog sizes")
+    parser.add_argument("--queries", type=int, default=200, help="queries per search type")
+    parser.add_argument("-k", type=int, default=10, help="results per query")
+    parser.add_argument("--workers", type=int, default=None, help="index build processes")
+    parser.add_argument("--crawl-pages", type=int, default=100, help="pages to crawl (0: skip the crawl)")
+    parser.add_argument("--crawl-workers", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="keep the generated files in this directory")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args(argv)
+
+    results = run(args.docs, args.queries, args.k, args.workers, args.crawl_pages,
+                  args.crawl_workers, args.seed, args.workdir)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    bitmap.py                                          :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 16:21:40 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 16:21:40 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Document sets stored as Python integers: bit i is set when document ID i is
+in the set. Union and intersection are then a single `|` or `&` running in C.
+"""
+
+from typing import Iterable, List
+
+# Bit positions set in every byte value, used to decode bitmaps byte by byte
+_BYTE_BITS = [[bit for bit in range(8) if value >> bit & 1] for value in range(256)]
+
+
+def from_ids(doc_ids: Iterable[int]) -> int:
+    """Build a bitmap from document IDs."""
+    doc_ids = list(doc_ids)
+    if not doc_ids:
+        return 0
+    buffer = bytearray(max(doc_ids) // 8 + 1)
+    for doc_id in doc_ids:
+        buffer[doc_id >> 3] |= 1 << (doc_id & 7)
+    return int.from_bytes(buffer, "little")
+
+
+def to_ids(bitmap: int) -> List[int]:
+    """Sorted document IDs of a bitmap."""
+    doc_ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for byte_number, byte in enumerate(data):
+        if byte:
+            base = byte_number << 3
+            doc_ids.extend(base + bit for bit in _BYTE_BITS[byte])
+    return doc_ids
+
+
+def count(bitmap: int) -> int:
+    """Number of documents in a bitmap."""
+    return bin(bitmap).count("1")
+
+
+def contains(bitmap: int, doc_id: int) -> bool:
+    return bool(bitmap >> doc_id & 1)
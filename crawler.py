@@ -11,17 +11,31 @@
 # **************************************************************************** #
 
 
+import asyncio
+import collections
 import time
-import json
-from utils import get_urls, can_fetch, extract_page_data
+from urllib.parse import urlparse
 
-def fetch_page(url, crawled_urls):
+import requests
+from requests.adapters import HTTPAdapter
+
+from file_writer import JsonlWriter
+from frontier import CrawlFrontier, CRAWLED, IN_PROGRESS, PENDING, SKIPPED
+from utils import ROBOTS_CACHE, can_fetch, extract_page_data
+
+# Délai par défaut entre deux requêtes vers un même hôte, si robots.txt n'en impose pas
+DEFAULT_CRAWL_DELAY = 5
+
+# Fichier de sortie : une page par ligne (JSONL), lisible directement par create_index.py
+OUTPUT_FILE = 'crawled_webpages.jsonl'
+
+def fetch_page(url):
     """
     Télécharge et extrait les données d'une page web si elle est autorisée par robots.txt.
+    L'URL n'est pas marquée explorée ici : l'appelant le fait une fois la page écrite.
 
     Args:
         url (str): L'URL de la page à récupérer.
-        crawled_urls (set): Ensemble des URLs déjà explorées.
 
     Returns:
         dict or None: Les données extraites de la page sous forme de dictionnaire,
@@ -29,7 +43,6 @@ def fetch_page(url, crawled_urls):
     """
 
     if url and can_fetch(url):
-        crawled_urls.add(url)
         page_data = extract_page_data(url)
 
         # Pause de 5 secondes pour éviter d'être détecté comme un bot (limite le risque de bannissement)
@@ -40,44 +53,255 @@ def fetch_page(url, crawled_urls):
     return None
 
 
-def crawl(start_url, max_urls=50):
-    crawled_urls = set()
-    urls_to_crawl = set(get_urls(start_url))
-    priority_urls = set()  # Stocke les URLs contenant "product"
-    results = []
+def open_output(frontier, output_file):
+    """
+    Ouvre le fichier JSONL de sortie et le synchronise avec les checkpoints de la
+    frontière : à chaque checkpoint les pages sont mises sur disque (fsync) et la
+    position atteinte est enregistrée. En reprise, le fichier est tronqué à cette
+    position, pour ne pas dupliquer les pages explorées après le dernier checkpoint.
+    """
+    offset = frontier.get_meta("output_offset")
+    if offset is None:
+        output = JsonlWriter(output_file)
+    else:
+        output = JsonlWriter(output_file, append=True, truncate_at=int(offset))
+
+    def sync_output(frontier):
+        output.flush(fsync=True)
+        frontier.set_meta("output_offset", str(output.tell()))
+
+    frontier.on_checkpoint = sync_output
+    return output
+
+
+def close_output(frontier, output):
+    """Dernier checkpoint, puis fermeture du fichier de sortie."""
+    frontier.checkpoint()
+    frontier.on_checkpoint = None
+    output.close()
+    print(f"{output.count} pages écrites dans {output.filename}")
+
+
+def crawl(start_url, max_urls=50, state_path=":memory:", checkpoint_every=20, output_file=OUTPUT_FILE):
+    """
+    Crawl séquentiel, en priorisant les URLs contenant "product".
+
+    Args:
+        start_url (str): L'URL de départ.
+        max_urls (int): Nombre maximum de pages à visiter (y compris lors des exécutions précédentes).
+        state_path (str): Fichier SQLite de la frontière. Avec un fichier, un crawl
+                          interrompu reprend au dernier checkpoint quand on le relance.
+        checkpoint_every (int): Nombre de changements d'état entre deux checkpoints.
+        output_file (str): Fichier JSONL où chaque page est écrite dès son extraction.
+
+    Returns:
+        str: Le chemin du fichier JSONL des pages visitées.
+    """
+    with CrawlFrontier(state_path, checkpoint_every) as frontier:
+        output = open_output(frontier, output_file)
+        # La page de départ est téléchargée une seule fois, comme les autres : ses liens alimentent la file
+        frontier.push(start_url)
+
+        while frontier.crawled_count < max_urls:
+            # Les URLs contenant "product" sortent en premier
+            url = frontier.pop()
+            if url is None:
+                break
+
+            page_data = fetch_page(url)
+            if page_data:
+                output.write(page_data)
+                # Explorée seulement une fois la page écrite : une erreur de
+                # téléchargement ne consomme pas une place de max_urls
+                frontier.mark(url, CRAWLED)
+                links = page_data.get("links", [])
+
+                # La frontière est sur disque : on garde tous les liens, même une fois
+                # la limite atteinte, pour qu'une reprise avec un max_urls plus grand les explore
+                for link in links:
+                    frontier.push(link)  # Ignorée si déjà vue
+            else:
+                # Refusée par robots.txt ou en erreur
+                frontier.mark(url, SKIPPED)
+            frontier.maybe_checkpoint()
+
+        close_output(frontier, output)
+
+    return output_file
+
 
-    if not urls_to_crawl:
-        urls_to_crawl = {start_url}
+class HostScheduler:
+    """
+    Planificateur de politesse par hôte pour le crawl asynchrone.
+
+    Chaque hôte est visité au plus une fois tous les `Crawl-delay` secondes
+    (robots.txt) ou, à défaut, tous les `default_delay` secondes. Les hôtes
+    différents ne s'attendent pas entre eux, contrairement au time.sleep global.
+    """
+
+    def __init__(self, session, default_delay=DEFAULT_CRAWL_DELAY, user_agent='*', robots_cache=None):
+        self.session = session
+        self.default_delay = default_delay
+        self.user_agent = user_agent
+        self.robots_cache = robots_cache or ROBOTS_CACHE
+        self._next_slot = {}   # hôte -> prochain instant autorisé
+        self._locks = {}       # hôte -> asyncio.Lock
+
+    async def robots(self, url):
+        """Retourne le robots.txt (analysé) de l'hôte de l'URL, via le cache partagé."""
+        rp = self.robots_cache.get_cached(url)
+        if rp is not None:
+            return rp
+        # Un seul téléchargement par hôte même si plusieurs workers le demandent
+        lock = self._locks.setdefault(urlparse(url).netloc, asyncio.Lock())
+        async with lock:
+            return await asyncio.to_thread(self.robots_cache.get, url, self.session)
+
+    async def can_fetch(self, url):
+        return (await self.robots(url)).can_fetch(self.user_agent, url)
+
+    async def wait_turn(self, url):
+        """Attend le prochain créneau libre de l'hôte de l'URL."""
+        robots = await self.robots(url)
+        delay = robots.crawl_delay(self.user_agent)
+        if delay is None:
+            delay = self.default_delay
+
+        host = urlparse(url).netloc
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # Réservation du créneau sans attendre : les autres workers prennent les suivants
+        slot = max(now, self._next_slot.get(host, now))
+        self._next_slot[host] = slot + float(delay)
+        await asyncio.sleep(slot - now)
+
+
+async def fetch_page_async(url, frontier, session, scheduler):
+    """
+    Version asynchrone de fetch_page : respecte robots.txt et le délai de l'hôte,
+    puis télécharge la page dans un thread avec la session partagée.
+
+    L'URL a été retirée de la frontière (IN_PROGRESS) par l'appelant, à qui il
+    revient de la marquer CRAWLED une fois la page écrite. Un checkpoint pris
+    entre-temps garde l'URL en cours, remise dans la file à la reprise.
+    Une URL refusée par robots.txt ou en erreur est marquée SKIPPED.
+
+    Returns:
+        dict or None: Les données extraites, ou None si la page est refusée ou en erreur.
+    """
+    if not await scheduler.can_fetch(url):
+        frontier.mark(url, SKIPPED)
+        return None
+
+    try:
+        await scheduler.wait_turn(url)
+        page_data = await asyncio.to_thread(extract_page_data, url, session)
+    except BaseException:
+        # Annulation ou erreur inattendue : l'URL repart dans la file
+        frontier.mark(url, PENDING)
+        raise
+    if not page_data:
+        frontier.mark(url, SKIPPED)
+    return page_data
+
+
+async def crawl_async(start_url, max_urls=50, workers=8, default_delay=DEFAULT_CRAWL_DELAY,
+                      robots_cache=None, state_path=":memory:", checkpoint_every=20,
+                      output_file=OUTPUT_FILE):
+    """
+    Crawl concurrent : `workers` tâches prennent leurs URLs dans la frontière
+    SQLite (les URLs contenant "product" d'abord), par paquets d'au plus
+    `workers` URLs, et partagent un pool de connexions HTTP et un planificateur
+    de politesse par hôte. Seules les URLs en cours sont en mémoire.
+
+    Args:
+        start_url (str): L'URL de départ.
+        max_urls (int): Nombre maximum de pages à visiter.
+        workers (int): Nombre de téléchargements simultanés.
+        default_delay (float): Délai par hôte quand robots.txt ne donne pas de Crawl-delay.
+        robots_cache (RobotsCache, optionnel): Cache des robots.txt (par défaut, le cache partagé).
+        state_path (str): Fichier SQLite de la frontière, pour reprendre un crawl interrompu.
+        checkpoint_every (int): Nombre de changements d'état entre deux checkpoints.
+        output_file (str): Fichier JSONL où chaque page est écrite dès son extraction.
+
+    Returns:
+        str: Le chemin du fichier JSONL des pages visitées.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    scheduler = HostScheduler(session, default_delay, robots_cache=robots_cache)
 
-    # Séparation des URLs en prioritaires et non prioritaires
-    for url in list(urls_to_crawl):
-        if "product" in url:
-            priority_urls.add(url)
-            urls_to_crawl.remove(url)
+    # La frontière SQLite garde la file et l'ensemble des URLs vues ; en mémoire,
+    # seulement le paquet d'URLs retirées de la file et pas encore distribuées
+    frontier = CrawlFrontier(state_path, checkpoint_every)
+    output = open_output(frontier, output_file)
+    frontier.push(start_url)
+    batch = collections.deque()
+    progress = asyncio.Condition()  # notifiée à chaque page traitée
 
-    while (priority_urls or urls_to_crawl) and len(crawled_urls) < max_urls:
-        # Prioriser les URLs contenant "product"
-        if priority_urls:
-            url = priority_urls.pop()
-        else:
-            url = urls_to_crawl.pop()
+    def next_url():
+        if not batch:
+            # Les URLs retirées comptent dans la limite, comme les pages en cours
+            room = max_urls - frontier.crawled_count - frontier.in_progress_count
+            if room > 0:
+                batch.extend(frontier.pop_many(min(room, workers)))
+        return batch.popleft() if batch else None
 
-        page_data = fetch_page(url, crawled_urls)
-        if page_data:
-            results.append(page_data)
-            links = page_data.get("links", [])
+    async def worker():
+        while True:
+            url = next_url()
+            if url is None:
+                if frontier.in_progress_count == 0:
+                    # Plus rien en attente ni en cours : les autres workers s'arrêtent aussi
+                    async with progress:
+                        progress.notify_all()
+                    return
+                # Les pages en cours peuvent ajouter des liens ou libérer une place
+                async with progress:
+                    await progress.wait()
+                continue
+            try:
+                page_data = await fetch_page_async(url, frontier, session, scheduler)
+                if page_data:
+                    # Explorée seulement une fois la page écrite : un checkpoint ne
+                    # valide jamais une URL CRAWLED absente du fichier de sortie
+                    output.write(page_data)
+                    frontier.mark(url, CRAWLED)
+                    # Tous les liens vont dans la frontière, sur disque, même une
+                    # fois la limite atteinte (reprise avec un max_urls plus grand)
+                    for link in page_data.get("links", []):
+                        frontier.push(link)
+                frontier.maybe_checkpoint()
+            except Exception as e:
+                print(f"Erreur lors du crawl de {url}: {e}")
+                if frontier.state(url) in (PENDING, IN_PROGRESS):
+                    frontier.mark(url, SKIPPED)
+            finally:
+                async with progress:
+                    progress.notify_all()
 
+    tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # URLs retirées mais jamais distribuées : elles restent à explorer
+        for url in batch:
+            frontier.mark(url, PENDING)
+        session.close()
+        close_output(frontier, output)
+        frontier.close()
 
-            for link in links:
-                if link not in crawled_urls and len(crawled_urls) < max_urls:
-                    if "product" in link:
-                        priority_urls.add(link)  # Ajouter en priorité
-                    else:
-                        urls_to_crawl.add(link)
+    return output_file
 
-    # Sauvegarde des résultats
-    print("Écriture des données dans un fichier JSON...")
-    with open('crawled_webpages.json', 'w', encoding='utf-8') as file:
-        json.dump(results, file, indent=4, ensure_ascii=False)
 
-    return results
+def crawl_concurrent(start_url, max_urls=50, workers=8, default_delay=DEFAULT_CRAWL_DELAY,
+                     robots_cache=None, state_path=":memory:", checkpoint_every=20,
+                     output_file=OUTPUT_FILE):
+    """Point d'entrée synchrone de crawl_async."""
+    return asyncio.run(crawl_async(start_url, max_urls, workers, default_delay, robots_cache,
+                                   state_path, checkpoint_every, output_file))
@@ -12,21 +12,31 @@
 
 
 
+import heapq
 import json
 import os
 import re
-import string
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 from urllib.parse import urlparse, parse_qs
 from collections import defaultdict
 
+from analyzer import DEFAULT_ANALYZER
+from index_format import DOC_TABLE_FILE, write_doc_table, write_index
+from segments import SegmentStore, index_segment_path
+
 # File configuration
 INPUT_FILE = "products.jsonl"
 PROCESSED_FILE = "processed_products.jsonl"
 INDEX_FOLDER = "index"  # Directory for storing indexes
-
-# Common English stopwords
-STOPWORDS = set(["the", "a", "an", "and", "or", "of", "to", "in", "on", "with", "for", "by", "at", "from", 
-                 "is", "it", "this", "that", "as", "are", "was", "were", "be", "been", "has", "have", "had"])
+INDEX_FORMAT = "json"  # "json" or "binary" (memory-mappable, see index_format.py)
+DOCUMENTS_FILE = "documents.jsonl"  # Doc ID -> URL and metadata table, in INDEX_FOLDER
+SEGMENT_FOLDER = index_segment_path()  # Delta segments of run_incremental: those of the index SearchEngine reads
+CHUNKS_PER_WORKER = 4  # Chunks handed to each indexing process, to even out their load
+ANALYZER = DEFAULT_ANALYZER  # Text analysis of the indexed fields (analyzer.Analyzer(stem=True) to stem)
+INDEX_META_FILE = "index_meta.json"  # Analyzer settings the indexes were built with, in INDEX_FOLDER
 
 
 def extract_product_info_from_url(url):
@@ -45,20 +55,40 @@ def extract_product_info_from_url(url):
         return {"product_id": None, "variant": None}
 
 
-def load_data(filename):
-    """Loads data from a JSONL file."""
+def iter_data(filename, follow=False, idle_timeout=30.0, poll_interval=0.5):
+    """
+    Yields documents from a JSONL file as they are read.
+
+    With follow=True the file is tailed while it is being written (e.g. the
+    crawler's crawled_webpages.jsonl): incomplete last lines are waited for,
+    and reading stops once no new line arrived for idle_timeout seconds.
+    """
     if not os.path.exists(filename):
         print(f"Error: File {filename} does not exist.")
-        return []
-    
-    data = []
+        return
+
     with open(filename, "r", encoding="utf-8") as file:
-        for line in file:
-            try:
-                data.append(json.loads(line.strip()))
-            except json.JSONDecodeError as e:
-                print(f"JSON decoding error: {e}")
-    return data
+        idle_since = time.monotonic()
+        while True:
+            position = file.tell()
+            line = file.readline()
+            if line.endswith("\n") or (line and not follow):
+                idle_since = time.monotonic()
+                try:
+                    yield json.loads(line.strip())
+                except json.JSONDecodeError as e:
+                    print(f"JSON decoding error: {e}")
+                continue
+            if not follow or time.monotonic() - idle_since > idle_timeout:
+                return
+            # Incomplete or missing line: wait for the writer
+            file.seek(position)
+            time.sleep(poll_interval)
+
+
+def load_data(filename):
+    """Loads data from a JSONL file."""
+    return list(iter_data(filename))
 
 
 def save_data(data, filename):
@@ -68,12 +98,26 @@ def save_data(data, filename):
             file.write(json.dumps(doc, ensure_ascii=False) + "\n")
 
 
+def assign_doc_ids(data):
+    """
+    Gives every document a dense integer ID (its position in the input).
+    Every index refers to documents through this ID.
+    """
+    return [doc | {"doc_id": doc_id} for doc_id, doc in enumerate(data)]
+
+
+def build_document_table(data):
+    """
+    Builds the single table mapping doc IDs to URLs and URL metadata.
+    """
+    return [{"doc_id": doc["doc_id"], "url": doc["url"],
+             "product_id": doc.get("product_id"), "variant": doc.get("variant")}
+            for doc in data]
+
+
 def tokenize(text):
-    """Tokenizes text by removing punctuation and stopwords."""
-    if not text:
-        return []
-    text = text.lower().translate(str.maketrans('', '', string.punctuation))
-    return [word for word in text.split() if word not in STOPWORDS]
+    """Tokenizes text by removing punctuation and stopwords (see analyzer.py)."""
+    return ANALYZER.analyze(text)
 
 
 def build_inverted_index_with_positions(field, data):
@@ -86,10 +130,24 @@ def build_inverted_index_with_positions(field, data):
     for doc in data:
         tokens = tokenize(doc.get(field, ""))
         for pos, token in enumerate(tokens):
-            index[token][doc['url']].append(pos)
+            index[token][doc['doc_id']].append(pos)
     return index
 
 
+def review_statistics(doc):
+    """
+    Total count, average rating and last rating of a document's reviews, or
+    None when it has none.
+    """
+    reviews = doc.get("product_reviews", [])
+    if not reviews:
+        return None
+    total_reviews = len(reviews)
+    avg_rating = sum(r.get("rating", 0) for r in reviews) / total_reviews
+    last_rating = reviews[-1].get("rating", None)
+    return {"total_reviews": total_reviews, "average_rating": avg_rating, "last_rating": last_rating}
+
+
 def build_reviews_index(data):
     """
 
@@ -98,12 +156,9 @@ def build_reviews_index(data):
     """
     index = {}
     for doc in data:
-        reviews = doc.get("product_reviews", [])
-        if reviews:
-            total_reviews = len(reviews)
-            avg_rating = sum(r.get("rating", 0) for r in reviews) / total_reviews
-            last_rating = reviews[-1].get("rating", None)
-            index[doc['url']] = {"total_reviews": total_reviews, "average_rating": avg_rating, "last_rating": last_rating}
+        statistics = review_statistics(doc)
+        if statistics is not None:
+            index[doc['doc_id']] = statistics
     return index
 
 
@@ -117,50 +172,238 @@ def build_feature_index(data, feature_name, feature_key):
     for doc in data:
         feature_value = doc.get("product_features", {}).get(feature_key, "")
         for token in tokenize(str(feature_value)):
-            index[token].add(doc['url'])
-    return {token: list(urls) for token, urls in index.items()}
+            index[token].add(doc['doc_id'])
+    return {token: sorted(doc_ids) for token, doc_ids in index.items()}
 
 
-def save_index(index, filename):
+def build_partial_indexes(data):
     """
-    Saves an index to a JSON file.
+    Builds every index of a chunk of documents in one pass, each field being
+    tokenized once. Terms are sorted so that partials can be k-way merged.
     """
-    os.makedirs(INDEX_FOLDER, exist_ok=True)
-    with open(os.path.join(INDEX_FOLDER, filename), "w", encoding="utf-8") as file:
+    title_index = defaultdict(dict)
+    description_index = defaultdict(dict)
+    brand_index = defaultdict(list)
+    origin_index = defaultdict(list)
+    reviews_index = {}
+    lengths_index = {}
+
+    for doc in data:
+        doc_id = doc["doc_id"]
+        field_tokens = ANALYZER.tokenize_many((doc.get("title", ""), doc.get("description", "")))
+        # Length as used by BM25: every title and description term, stopwords included
+        lengths_index[doc_id] = sum(len(tokens) for tokens in field_tokens)
+        for tokens, index in zip(field_tokens, (title_index, description_index)):
+            terms = [token for token in tokens if token not in ANALYZER.stopwords]
+            for pos, token in enumerate(terms):
+                index[token].setdefault(doc_id, []).append(pos)
+
+        features = doc.get("product_features", {})
+        for feature_key, index in (("brand", brand_index), ("made in", origin_index)):
+            for token in dict.fromkeys(tokenize(str(features.get(feature_key, "")))):
+                index[token].append(doc_id)
+
+        statistics = review_statistics(doc)
+        if statistics is not None:
+            reviews_index[doc_id] = statistics
+
+    return {
+        "title": sorted(title_index.items()),
+        "description": sorted(description_index.items()),
+        "brand": sorted(brand_index.items()),
+        "made_in": sorted(origin_index.items()),
+        "reviews": reviews_index,
+        "lengths": lengths_index,
+    }
+
+
+def merge_partial_indexes(partials):
+    """
+    K-way merges partial indexes built by build_partial_indexes.
+
+    partials must be in doc ID order (chunks of consecutive documents), so the
+    postings of a term are concatenated without sorting them again.
+    """
+    merged = {}
+    for name in ("title", "description", "brand", "made_in"):
+        index = {}
+        # heapq.merge keeps the order of the partials for equal terms
+        for token, entries in groupby(heapq.merge(*(partial[name] for partial in partials),
+                                                  key=itemgetter(0)), key=itemgetter(0)):
+            postings = None
+            for _, chunk_postings in entries:
+                if postings is None:
+                    postings = chunk_postings
+                elif isinstance(postings, dict):
+                    postings.update(chunk_postings)
+                else:
+                    postings.extend(chunk_postings)
+            index[token] = postings
+        merged[name] = index
+
+    for name in ("reviews", "lengths"):
+        merged[name] = {}
+        for partial in partials:
+            merged[name].update(partial[name])
+    return merged
+
+
+def build_indexes_parallel(data, workers=None):
+    """
+    Builds the title, description, brand, origin, reviews and lengths indexes
+    with a pool of processes: data is split into chunks of consecutive
+    documents, each chunk is indexed by build_partial_indexes and the partial
+    indexes are merged by merge_partial_indexes.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, -(-len(data) // (workers * CHUNKS_PER_WORKER)))
+    chunks = [data[start:start + chunk_size] for start in range(0, len(data), chunk_size)]
+    if workers == 1 or len(chunks) == 1:
+        partials = [build_partial_indexes(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            partials = list(executor.map(build_partial_indexes, chunks))
+    return merge_partial_indexes(partials)
+
+
+def save_index(index, filename, index_folder=INDEX_FOLDER):
+    """
+    Saves an index to a JSON file in index_folder.
+    """
+    os.makedirs(index_folder, exist_ok=True)
+    with open(os.path.join(index_folder, filename), "w", encoding="utf-8") as file:
         json.dump(index, file, indent=4, ensure_ascii=False)
 
 
-def run():
+def save_doc_table(doc_urls, index_folder=INDEX_FOLDER):
     """
-    Executes the full pipeline.
-    
+    Saves the doc ID -> URL table shared by the binary indexes.
+    """
+    os.makedirs(index_folder, exist_ok=True)
+    write_doc_table(doc_urls, os.path.join(index_folder, DOC_TABLE_FILE))
+
+
+def save_binary_index(index, filename, index_folder=INDEX_FOLDER):
+    """
+    Saves a posting index in the binary format, next to where the JSON would
+    go. Documents are stored as doc IDs of the table written by save_doc_table.
+    """
+    os.makedirs(index_folder, exist_ok=True)
+    write_index(index, os.path.join(index_folder, os.path.splitext(filename)[0] + ".bin"), shared_docs=True)
+
+
+def process_data(docs, processed_file=PROCESSED_FILE, index_folder=INDEX_FOLDER):
     """
-    data = load_data(INPUT_FILE)
-    if not data:
+    First step of run: extracts product information from the URLs, assigns
+    doc IDs and saves the processed data and the document table.
+    Returns (processed_data, documents); both are empty if docs is.
+    """
+    processed_data = assign_doc_ids(
+        [doc | extract_product_info_from_url(doc.get("url", "")) for doc in docs])
+    if not processed_data:
+        return [], []
+
+    save_data(processed_data, processed_file)
+    documents = build_document_table(processed_data)
+    os.makedirs(index_folder, exist_ok=True)
+    save_data(documents, os.path.join(index_folder, DOCUMENTS_FILE))
+    return processed_data, documents
+
+
+def index_by_url(index, doc_urls):
+    """
+    Replaces the doc IDs of a posting index by the URLs of the documents,
+    which identify documents in the JSON indexes.
+    """
+    return {token: {doc_urls[doc_id]: positions for doc_id, positions in postings.items()}
+            if isinstance(postings, dict) else [doc_urls[doc_id] for doc_id in postings]
+            for token, postings in index.items()}
+
+
+def save_indexes(indexes, documents, index_folder=INDEX_FOLDER, index_format=INDEX_FORMAT):
+    """
+    Last step of run: saves the indexes built by build_indexes_parallel in
+    index_format ("json" or "binary"), with the analyzer metadata.
+
+    Binary postings keep the doc IDs of the shared doc table; JSON ones, and
+    the reviews and lengths (per document statistics, always in JSON), are
+    keyed by URL.
+    """
+    doc_urls = [doc["url"] for doc in documents]
+    if index_format == "binary":
+        save_doc_table(doc_urls, index_folder)
+        save_postings = save_binary_index
+    else:
+        def save_postings(index, filename, folder):
+            save_index(index_by_url(index, doc_urls), filename, folder)
+    save_postings(indexes["title"], "index_title.json", index_folder)
+    save_postings(indexes["description"], "index_description.json", index_folder)
+    for name in ("reviews", "lengths"):
+        save_index({doc_urls[doc_id]: statistics for doc_id, statistics in indexes[name].items()},
+                   f"index_{name}.json", index_folder)
+    save_postings(indexes["brand"], "index_brand.json", index_folder)
+    save_postings(indexes["made_in"], "index_made_in.json", index_folder)
+    save_index(ANALYZER.metadata(), INDEX_META_FILE, index_folder)
+
+
+def run(input_file=INPUT_FILE, follow=False, workers=None, index_folder=INDEX_FOLDER,
+        index_format=INDEX_FORMAT, processed_file=PROCESSED_FILE):
+    """
+    Executes the full pipeline: process_data, build_indexes_parallel and
+    save_indexes.
+
+    input_file can be the crawler's JSONL output; with follow=True it is
+    consumed while the crawl is still writing it (see iter_data). Indexes are
+    built by `workers` processes (default: one per CPU) and written to
+    index_folder in index_format.
+    """
+    # Extract product information from URL and assign doc IDs, line by line
+    processed_data, documents = process_data(iter_data(input_file, follow), processed_file, index_folder)
+    if not processed_data:
         print("No data loaded, stopping pipeline.")
         return
-    
-    # Extract product information from URL
-    processed_data = [doc | extract_product_info_from_url(doc.get("url", "")) for doc in data]
-    save_data(processed_data, PROCESSED_FILE)
     print("Processed data saved!")
-    
+
     # Build indexes
-    title_index = build_inverted_index_with_positions("title", processed_data)
-    description_index = build_inverted_index_with_positions("description", processed_data)
-    reviews_index = build_reviews_index(processed_data)
-    brand_index = build_feature_index(processed_data, "brand", "brand")
-    origin_index = build_feature_index(processed_data, "made_in", "made in")
-    
+    indexes = build_indexes_parallel(processed_data, workers)
+
     # Save indexes
-    save_index(title_index, "index_title.json")
-    save_index(description_index, "index_description.json")
-    save_index(reviews_index, "index_reviews.json")
-    save_index(brand_index, "index_brand.json")
-    save_index(origin_index, "index_made_in.json")
-    
+    save_indexes(indexes, documents, index_folder, index_format)
     print("All indexes generated and saved!")
 
 
+def run_incremental(changes_file, segment_folder=SEGMENT_FOLDER, merge=True):
+    """
+    Applies a batch of changed products without rebuilding the indexes.
+
+    changes_file is a JSONL file of products to add or update (matched by
+    URL) and of {"url": ..., "deleted": true} records for removals. They are
+    written as one small delta segment that SearchEngine picks up without a
+    restart; segments are merged together in a background thread once there
+    are too many.
+
+    Segments are never folded into the main indexes: run() neither reads nor
+    clears them. To start from fresh indexes, rebuild them with run() from a
+    catalog that includes the changes, then remove the segment folder.
+    """
+    changes = []
+    for doc in iter_data(changes_file):
+        if doc.get("deleted"):
+            changes.append({"op": "delete", "url": doc["url"]})
+        else:
+            changes.append({"op": "upsert", "doc": doc | extract_product_info_from_url(doc.get("url", ""))})
+
+    store = SegmentStore(segment_folder)
+    name = store.write_segment(changes)
+    if name is None:
+        print("No changes loaded, nothing to do.")
+        return None
+    print(f"Segment {name} written ({len(changes)} changes)")
+
+    if merge:
+        store.merge_in_background()
+    return name
+
+
 if __name__ == "__main__":
     run()
@@ -13,6 +13,7 @@
 
 
 import json
+import os
 
 def write_to_file(filename, data):
     """Écrit des données dans un fichier JSON.
@@ -23,3 +24,53 @@ def write_to_file(filename, data):
     """
     with open(filename, 'w', encoding='utf-8') as file:
         json.dump(data, file, indent=4)
+
+
+class JsonlWriter:
+    """Écrit des enregistrements JSON ligne par ligne (JSONL), au fur et à mesure.
+
+    Les lignes sont regroupées dans un tampon de `buffer_size` octets ; flush(fsync=True)
+    garantit qu'elles sont sur disque (à appeler aux checkpoints). En mode ajout, le
+    fichier peut être tronqué à la position du dernier checkpoint pour reprendre proprement.
+
+    Args:
+        filename (str): Le chemin du fichier JSONL.
+        append (bool): Ajoute à la fin du fichier au lieu de l'écraser.
+        truncate_at (int, optionnel): Position (en octets) à laquelle tronquer le fichier avant d'écrire.
+        buffer_size (int): Taille du tampon d'écriture.
+    """
+
+    def __init__(self, filename, append=False, truncate_at=None, buffer_size=1 << 16):
+        self.filename = filename
+        self._file = open(filename, 'a' if append else 'w', encoding='utf-8', buffering=buffer_size)
+        if truncate_at is not None and truncate_at < self._file.tell():
+            self._file.truncate(truncate_at)
+            self._file.seek(truncate_at)
+        self.count = 0
+
+    def write(self, record):
+        """Ajoute un enregistrement (une ligne)."""
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.count += 1
+
+    def tell(self):
+        """Position courante (en octets) à la fin des données écrites."""
+        self._file.flush()
+        return self._file.buffer.tell()
+
+    def flush(self, fsync=False):
+        """Vide le tampon ; avec fsync, attend que les données soient sur disque."""
+        self._file.flush()
+        if fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush(fsync=True)
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
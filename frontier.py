@@ -0,0 +1,166 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    frontier.py                                        :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 16:58:02 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 16:58:02 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+import sqlite3
+
+# États d'une URL dans la frontière
+PENDING = 0      # à explorer
+IN_PROGRESS = 1  # retirée de la file, pas encore explorée
+CRAWLED = 2      # explorée, données enregistrées
+SKIPPED = 3      # refusée par robots.txt ou en erreur
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL UNIQUE,
+    priority INTEGER NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS urls_queue ON urls (state, priority, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def url_priority(url):
+    """0 pour les URLs contenant "product" (explorées en premier), 1 sinon."""
+    return 0 if "product" in url else 1
+
+
+class CrawledView:
+    """Vue « ensemble » des URLs explorées, utilisable à la place du set crawled_urls."""
+
+    def __init__(self, frontier):
+        self._frontier = frontier
+
+    def add(self, url):
+        self._frontier.mark(url, CRAWLED)
+
+    def __contains__(self, url):
+        return self._frontier.state(url) == CRAWLED
+
+    def __len__(self):
+        return self._frontier.crawled_count
+
+
+class CrawlFrontier:
+    """
+    Frontière de crawl persistante (SQLite) : file à priorité et ensemble des
+    URLs déjà vues, plus quelques métadonnées (position du fichier de sortie...).
+
+    Les écritures sont regroupées dans une transaction validée tous les
+    `checkpoint_every` changements d'état (et à la fermeture) : après un arrêt
+    brutal, le crawl reprend au dernier checkpoint. Rien n'est gardé en mémoire,
+    la taille du crawl n'est limitée que par le disque.
+
+    `on_checkpoint` est appelé juste avant chaque validation, par exemple pour
+    mettre sur disque les pages écrites depuis le checkpoint précédent.
+    """
+
+    def __init__(self, path=":memory:", checkpoint_every=20, on_checkpoint=None):
+        self.path = path
+        self.checkpoint_every = checkpoint_every
+        self.on_checkpoint = on_checkpoint
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(SCHEMA)
+        # Les URLs en cours lors de l'arrêt précédent sont remises dans la file
+        self._connection.execute("UPDATE urls SET state = ? WHERE state = ?", (PENDING, IN_PROGRESS))
+        self._connection.commit()
+        self.crawled_count = self._connection.execute(
+            "SELECT COUNT(*) FROM urls WHERE state = ?", (CRAWLED,)).fetchone()[0]
+        self.in_progress_count = 0
+        self._changes = 0
+        self.crawled = CrawledView(self)
+
+    def push(self, url):
+        """Ajoute une URL à la file si elle n'a jamais été vue. Retourne True si elle est nouvelle."""
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO urls (url, priority) VALUES (?, ?)", (url, url_priority(url)))
+        return cursor.rowcount > 0
+
+    def pop(self):
+        """Retire la prochaine URL à explorer (priorité, puis ordre d'arrivée), ou None."""
+        urls = self.pop_many(1)
+        return urls[0] if urls else None
+
+    def pop_many(self, limit):
+        """Retire jusqu'à `limit` URLs à explorer, dans l'ordre de la file (IN_PROGRESS)."""
+        rows = self._connection.execute(
+            "SELECT id, url FROM urls WHERE state = ? ORDER BY priority, id LIMIT ?",
+            (PENDING, limit)).fetchall()
+        self._connection.executemany(
+            "UPDATE urls SET state = ? WHERE id = ?", [(IN_PROGRESS, row_id) for row_id, _ in rows])
+        self.in_progress_count += len(rows)
+        return [url for _, url in rows]
+
+    def pending(self, batch_size=1000):
+        """URLs encore à explorer, dans l'ordre de la file, lues par paquets de `batch_size`."""
+        last = (-1, -1)
+        while True:
+            rows = self._connection.execute(
+                "SELECT priority, id, url FROM urls WHERE state = ? AND (priority, id) > (?, ?) "
+                "ORDER BY priority, id LIMIT ?", (PENDING, *last, batch_size)).fetchall()
+            if not rows:
+                return
+            for _, _, url in rows:
+                yield url
+            last = rows[-1][:2]
+
+    def state(self, url):
+        row = self._connection.execute("SELECT state FROM urls WHERE url = ?", (url,)).fetchone()
+        return row[0] if row else None
+
+    def mark(self, url, state):
+        """Change l'état d'une URL (l'ajoute si besoin)."""
+        previous = self.state(url)
+        if previous is None:
+            self._connection.execute(
+                "INSERT INTO urls (url, priority, state) VALUES (?, ?, ?)", (url, url_priority(url), state))
+        else:
+            self._connection.execute("UPDATE urls SET state = ? WHERE url = ?", (state, url))
+        if state == CRAWLED and previous != CRAWLED:
+            self.crawled_count += 1
+        self.in_progress_count += (state == IN_PROGRESS) - (previous == IN_PROGRESS)
+        self._changes += 1
+
+    def get_meta(self, key, default=None):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def maybe_checkpoint(self):
+        """Fait un checkpoint tous les `checkpoint_every` changements d'état.
+        À appeler quand une page est entièrement traitée (état et données)."""
+        if self._changes >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Valide sur disque toutes les modifications depuis le dernier checkpoint."""
+        if self.on_checkpoint is not None:
+            self.on_checkpoint(self)
+        self._connection.commit()
+        self._changes = 0
+
+    def close(self):
+        self.checkpoint()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
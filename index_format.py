@@ -0,0 +1,492 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    index_format.py                                    :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 16:02:11 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 16:02:11 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Compact binary format for inverted indexes.
+
+File layout (little endian):
+    header      magic, version, flags, number of documents and terms,
+                offsets of the three sections below
+    doc table   (n_docs + 1) uint32 offsets followed by the UTF-8 URLs
+    term dict   one fixed size entry per term, sorted by term bytes, followed
+                by the UTF-8 terms
+    postings    per term: varint doc ID deltas, and when the index stores
+                positions, the number of positions and their varint deltas
+
+The indexes built by create_index share one doc table: it is written once
+to DOC_TABLE_FILE (a header with the number of documents, followed by the
+doc table section above) and their files hold an empty doc table and the
+FLAG_SHARED_DOCS flag. Their doc IDs are looked up in the DOC_TABLE_FILE of
+their folder.
+
+The reader opens the file with mmap and only decodes the postings of the
+terms that are looked up, so opening an index does not depend on its size
+and several processes share the same pages.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from functools import lru_cache
+from typing import Container, Dict, Iterator, List, Optional, Tuple, Union
+
+MAGIC = b"IDXB"
+VERSION = 2
+# Versions the reader understands (version 1 files always embed their doc table)
+READABLE_VERSIONS = (1, 2)
+
+# Header flags
+FLAG_POSITIONS = 1
+FLAG_SHARED_DOCS = 2
+
+HEADER = struct.Struct("<4sHHIIQQQ")
+TERM_ENTRY = struct.Struct("<IIQII")
+OFFSET = struct.Struct("<I")
+
+# Doc table shared by the indexes of a folder
+DOC_TABLE_MAGIC = b"DOCT"
+DOC_TABLE_FILE = "documents.bin"
+DOC_TABLE_HEADER = struct.Struct("<4sHI")
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    """Append an unsigned integer to out using 7 bits per byte."""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data, pos: int) -> Tuple[int, int]:
+    """Read an unsigned varint from data at pos, return (value, next position)."""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+class _IdentityIds:
+    """Mapping used when postings are already keyed by doc ID (int or JSON string)."""
+
+    def __getitem__(self, key) -> int:
+        return int(key)
+
+
+def _build_doc_table(index: Dict) -> List[str]:
+    """Collect every document URL referenced by the index, in sorted order."""
+    urls = set()
+    for postings in index.values():
+        urls.update(postings)
+    return sorted(urls)
+
+
+def _encode_doc_table(doc_urls: List[str]) -> Tuple[bytearray, bytearray]:
+    """Offsets and UTF-8 blob of a doc table."""
+    doc_blob = bytearray()
+    doc_offsets = bytearray()
+    for url in doc_urls:
+        doc_offsets += OFFSET.pack(len(doc_blob))
+        doc_blob += url.encode("utf-8")
+    doc_offsets += OFFSET.pack(len(doc_blob))
+    return doc_offsets, doc_blob
+
+
+def _write_atomic(path: str, *parts: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        for part in parts:
+            file.write(part)
+    os.replace(tmp_path, path)
+
+
+def write_doc_table(doc_urls: List[str], path: str) -> None:
+    """
+    Write the doc table shared by the indexes of a folder (DOC_TABLE_FILE):
+    doc ID i is the document with URL doc_urls[i].
+    """
+    doc_offsets, doc_blob = _encode_doc_table(doc_urls)
+    _write_atomic(path, DOC_TABLE_HEADER.pack(DOC_TABLE_MAGIC, VERSION, len(doc_urls)), doc_offsets, doc_blob)
+
+
+def write_index(index: Dict, path: str, shared_docs: bool = False) -> None:
+    """
+    Write an index to the binary format.
+
+    Positional indexes map term -> {doc: [positions]}, feature indexes map
+    term -> [docs]; the kind is detected from the values. Documents are URLs,
+    stored in the file's own doc table, or with shared_docs=True integer doc
+    IDs of the doc table written by write_doc_table in the same folder.
+    """
+    positional = any(isinstance(postings, dict) for postings in index.values())
+    if shared_docs:
+        doc_urls = []
+        doc_ids = _IdentityIds()
+    else:
+        doc_urls = _build_doc_table(index)
+        doc_ids = {url: doc_id for doc_id, url in enumerate(doc_urls)}
+    doc_offsets, doc_blob = _encode_doc_table(doc_urls)
+
+    # Postings and term dictionary
+    terms = sorted(index, key=lambda term: term.encode("utf-8"))
+    postings_blob = bytearray()
+    term_blob = bytearray()
+    term_entries = bytearray()
+    for term in terms:
+        postings = index[term]
+        start = len(postings_blob)
+        previous = 0
+        for doc_id, key in sorted((doc_ids[key], key) for key in postings):
+            encode_varint(doc_id - previous, postings_blob)
+            previous = doc_id
+            if positional:
+                positions = sorted(postings[key])
+                encode_varint(len(positions), postings_blob)
+                last = 0
+                for position in positions:
+                    encode_varint(position - last, postings_blob)
+                    last = position
+        term_bytes = term.encode("utf-8")
+        term_entries += TERM_ENTRY.pack(len(term_blob), len(term_bytes), start,
+                                        len(postings_blob) - start, len(postings))
+        term_blob += term_bytes
+
+    doc_table_offset = HEADER.size
+    term_dict_offset = doc_table_offset + len(doc_offsets) + len(doc_blob)
+    postings_offset = term_dict_offset + len(term_entries) + len(term_blob)
+    flags = (FLAG_POSITIONS if positional else 0) | (FLAG_SHARED_DOCS if shared_docs else 0)
+
+    _write_atomic(path, HEADER.pack(MAGIC, VERSION, flags, len(doc_urls), len(terms),
+                                    doc_table_offset, term_dict_offset, postings_offset),
+                  doc_offsets, doc_blob, term_entries, term_blob, postings_blob)
+
+
+class DocTable:
+    """
+    Read-only, memory-mapped doc table: the URL of each doc ID, either
+    embedded in an index file or shared by a folder (DOC_TABLE_FILE).
+    """
+
+    def __init__(self, mm, offset: int, n_docs: int):
+        self._mm = mm
+        self._offsets = offset
+        self._blob = offset + OFFSET.size * (n_docs + 1)
+        self.n_docs = n_docs
+        self._file = None
+
+    @classmethod
+    def open(cls, path: str) -> "DocTable":
+        """Open a doc table written by write_doc_table."""
+        file = open(path, "rb")
+        mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_docs = DOC_TABLE_HEADER.unpack_from(mm, 0)
+        if magic != DOC_TABLE_MAGIC or version not in READABLE_VERSIONS:
+            raise ValueError(f"{path} is not a doc table (version {VERSION})")
+        table = cls(mm, DOC_TABLE_HEADER.size, n_docs)
+        table._file = file
+        return table
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._mm.close()
+            self._file.close()
+
+    def url(self, doc_id: int) -> str:
+        start, = OFFSET.unpack_from(self._mm, self._offsets + OFFSET.size * doc_id)
+        end, = OFFSET.unpack_from(self._mm, self._offsets + OFFSET.size * (doc_id + 1))
+        return self._mm[self._blob + start:self._blob + end].decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+
+@lru_cache(maxsize=16)
+def _shared_doc_table(path: str, mtime_ns: int) -> DocTable:
+    """Doc table of a folder, opened once for all of its indexes (until it is rewritten)."""
+    return DocTable.open(path)
+
+
+class BinaryIndex:
+    """
+    Read-only, memory-mapped view of a binary index.
+
+    Behaves like the dictionaries loaded from the JSON indexes: positional
+    indexes return {url: [positions]} for a term, feature indexes return a
+    list of URLs.
+    """
+
+    def __init__(self, path: str, cache_size: int = 4096, doc_table: DocTable = None):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, flags, n_docs, self.n_terms, doc_table_offset,
+         self._term_dict, self._postings) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version not in READABLE_VERSIONS:
+            raise ValueError(f"{path} is not a binary index (version {VERSION})")
+        self.positional = bool(flags & FLAG_POSITIONS)
+        if not flags & FLAG_SHARED_DOCS:
+            doc_table = DocTable(self._mm, doc_table_offset, n_docs)
+        elif doc_table is None:
+            table_path = os.path.join(os.path.dirname(os.path.abspath(path)), DOC_TABLE_FILE)
+            doc_table = _shared_doc_table(table_path, os.stat(table_path).st_mtime_ns)
+        self.doc_table = doc_table
+        self.n_docs = len(doc_table)
+        self._term_blob = self._term_dict + TERM_ENTRY.size * self.n_terms
+        self._decode = lru_cache(maxsize=cache_size)(self._decode_term)
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def doc_url(self, doc_id: int) -> str:
+        """URL of a document ID of this file."""
+        return self.doc_table.url(doc_id)
+
+    def _term_at(self, i: int) -> Tuple[bytes, int, int, int]:
+        """Term bytes, postings offset, postings length and doc count of entry i."""
+        term_offset, term_len, postings_offset, postings_len, doc_count = \
+            TERM_ENTRY.unpack_from(self._mm, self._term_dict + TERM_ENTRY.size * i)
+        start = self._term_blob + term_offset
+        return self._mm[start:start + term_len], postings_offset, postings_len, doc_count
+
+    def _find(self, term: str) -> int:
+        """Binary search the term dictionary, return the entry number or -1."""
+        key = term.encode("utf-8")
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term_at(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_terms and self._term_at(low)[0] == key:
+            return low
+        return -1
+
+    def postings(self, term: str) -> List[Tuple[int, List[int]]]:
+        """Decoded (doc ID, positions) pairs of a term, sorted by doc ID."""
+        entry = self._find(term)
+        if entry < 0:
+            return []
+        return self._decode(entry)
+
+    def _decode_term(self, entry: int) -> List[Tuple[int, List[int]]]:
+        _, postings_offset, postings_len, doc_count = self._term_at(entry)
+        pos = self._postings + postings_offset
+        data = self._mm
+        result = []
+        doc_id = 0
+        for _ in range(doc_count):
+            delta, pos = decode_varint(data, pos)
+            doc_id += delta
+            positions = []
+            if self.positional:
+                count, pos = decode_varint(data, pos)
+                position = 0
+                for _ in range(count):
+                    delta, pos = decode_varint(data, pos)
+                    position += delta
+                    positions.append(position)
+            result.append((doc_id, positions))
+        return result
+
+    def doc_count(self, term: str) -> int:
+        """Number of documents containing a term, read from the dictionary."""
+        entry = self._find(term)
+        return self._term_at(entry)[3] if entry >= 0 else 0
+
+    def __contains__(self, term: str) -> bool:
+        return self._find(term) >= 0
+
+    def __getitem__(self, term: str) -> Union[Dict[str, List[int]], List[str]]:
+        entry = self._find(term)
+        if entry < 0:
+            raise KeyError(term)
+        postings = self._decode(entry)
+        if self.positional:
+            return {self.doc_url(doc_id): positions for doc_id, positions in postings}
+        return [self.doc_url(doc_id) for doc_id, _ in postings]
+
+    def get(self, term: str, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+    def __len__(self) -> int:
+        return self.n_terms
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.n_terms):
+            yield self._term_at(i)[0].decode("utf-8")
+
+    def keys(self) -> Iterator[str]:
+        return iter(self)
+
+    def items(self):
+        for term in self:
+            yield term, self[term]
+
+
+class FilteredIndex:
+    """
+    View of an index restricted to some documents (by URL): the postings of
+    the others are dropped when a term is looked up. Lets each shard keep
+    its part of a memory-mapped index, whose pages all shard processes share.
+    """
+
+    def __init__(self, index: Union[BinaryIndex, Dict], keep: Container[str]):
+        self.index = index
+        self.keep = keep
+
+    def __contains__(self, term: str) -> bool:
+        return term in self.index
+
+    def __getitem__(self, term: str) -> Union[Dict[str, List[int]], List[str]]:
+        postings = self.index[term]
+        if isinstance(postings, dict):
+            return {url: positions for url, positions in postings.items() if url in self.keep}
+        return [url for url in postings if url in self.keep]
+
+    def get(self, term: str, default=None):
+        try:
+            return self[term]
+        except KeyError:
+            return default
+
+
+def restrict_index(index: Union[BinaryIndex, Dict], keep: Container[str]) -> Union[FilteredIndex, Dict]:
+    """
+    The part of an index about the documents in keep (URLs). Dictionaries
+    are copied without the other documents' postings, so that the full one
+    can be freed; binary indexes stay mapped behind a FilteredIndex.
+    """
+    if isinstance(index, BinaryIndex):
+        return FilteredIndex(index, keep)
+    restricted = {}
+    for term, postings in index.items():
+        if isinstance(postings, dict):
+            postings = {url: positions for url, positions in postings.items() if url in keep}
+        else:
+            postings = [url for url in postings if url in keep]
+        if postings:
+            restricted[term] = postings
+    return restricted
+
+
+class RemappedIndex:
+    """
+    Postings of an index by the doc IDs of its reader (e.g. SearchEngine),
+    whatever the index identifies documents by. Documents missing from
+    doc_ids (URL -> doc ID) are dropped, e.g. those of other shards.
+
+    Binary postings go through a table from the doc IDs of their doc table,
+    built once when the index is opened (and shared by the indexes given the
+    same `tables` dict). JSON postings are keyed by URL and are looked up in
+    doc_ids term by term.
+    """
+
+    def __init__(self, index: Union[BinaryIndex, Dict], doc_ids: Dict[str, int],
+                 tables: Optional[Dict[DocTable, List[int]]] = None):
+        self.index = index
+        self.doc_ids = doc_ids
+        self._table = None
+        if isinstance(index, BinaryIndex):
+            tables = {} if tables is None else tables
+            self._table = tables.get(index.doc_table)
+            if self._table is None:
+                self._table = tables[index.doc_table] = [
+                    doc_ids.get(index.doc_url(doc_id), -1) for doc_id in range(index.n_docs)]
+
+    def postings(self, term: str) -> List[Tuple[int, List[int]]]:
+        """(doc ID, sorted positions) pairs of a term; positions are empty for feature indexes."""
+        if self._table is not None:
+            table = self._table
+            return [(table[doc_id], positions) for doc_id, positions in self.index.postings(term)
+                    if table[doc_id] >= 0]
+        postings = self.index.get(term)
+        if not postings:
+            return []
+        doc_ids = self.doc_ids
+        if isinstance(postings, dict):
+            return [(doc_ids[url], sorted(positions)) for url, positions in postings.items() if url in doc_ids]
+        return [(doc_ids[url], []) for url in postings if url in doc_ids]
+
+    def documents(self, term: str) -> List[int]:
+        """Doc IDs of the documents containing a term."""
+        if self._table is not None:
+            table = self._table
+            return [table[doc_id] for doc_id, _ in self.index.postings(term) if table[doc_id] >= 0]
+        doc_ids = self.doc_ids
+        return [doc_ids[url] for url in self.index.get(term) or () if url in doc_ids]
+
+    def doc_count(self, term: str) -> int:
+        """Number of documents containing a term."""
+        if self._table is None:
+            return len(self.index.get(term) or ())
+        return len(self.documents(term))
+
+
+def _keep_postings(obj: Dict, keep: Container[str]) -> Dict:
+    """
+    json object_hook of open_index: posting dicts (URL -> positions) are
+    filtered as soon as they are decoded, other objects are left as is.
+    """
+    first = next(iter(obj.values()), None)
+    if isinstance(first, list) and first and isinstance(first[0], int):
+        return {url: positions for url, positions in obj.items() if url in keep}
+    return obj
+
+
+def open_index(path: str, keep: Optional[Container[str]] = None) -> Union[BinaryIndex, FilteredIndex, Dict]:
+    """
+    Open an index, memory-mapping binary files and parsing JSON ones.
+    With keep (URLs), only the postings of those documents are kept
+    (see restrict_index); JSON postings are filtered while parsing so the
+    full index is never held in memory.
+    """
+    if path.endswith(".bin"):
+        index = BinaryIndex(path)
+        return index if keep is None else FilteredIndex(index, keep)
+    with open(path, "r", encoding="utf-8") as file:
+        if keep is None:
+            return json.load(file)
+        index = json.load(file, object_hook=lambda obj: _keep_postings(obj, keep))
+    return restrict_index(index, keep)
+
+
+def convert_json_index(json_path: str, bin_path: str = None) -> str:
+    """Convert a JSON posting index to the binary format, return the new path."""
+    if bin_path is None:
+        bin_path = os.path.splitext(json_path)[0] + ".bin"
+    with open(json_path, "r", encoding="utf-8") as file:
+        write_index(json.load(file), bin_path)
+    return bin_path
+
+
+if __name__ == "__main__":
+    # Usage: python index_format.py fichier_prof/title_index.json ...
+    for json_path in sys.argv[1:]:
+        print(f"{json_path} -> {convert_json_index(json_path)}")
@@ -16,5 +16,6 @@ from crawler import crawl
 
 if __name__ == "__main__":
     start_url = "https://web-scraping.dev/products"
-    crawled = crawl(start_url)
+    # L'état du crawl est sauvegardé : relancer le script reprend là où il s'est arrêté
+    crawled = crawl(start_url, state_path="crawl_state.db")
     #print(f"URLs Crawled: {len(crawled)}")
@@ -0,0 +1,112 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    product_store.py                                   :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 19:12:05 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 19:12:05 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Products of a JSONL file, decoded on demand.
+
+The file is read once to find where each record starts; afterwards only that
+offset table stays in memory. A product is decoded from the memory-mapped
+file when it is asked for, and the most recently used ones are kept in a
+small LRU cache. Products added later (delta segments) are held in memory.
+"""
+
+import json
+import mmap
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, Optional, Tuple
+
+
+class ProductStore:
+    """
+    Products by doc ID: the records of the file kept by scan, in file order,
+    followed by the products added with append.
+    """
+
+    def __init__(self, path: str, cache_size: int = 256):
+        self.path = path
+        self.cache_size = cache_size
+        self.line_count = 0
+        self._offsets = array("Q")
+        self._added: Dict[int, Dict] = {}
+        self._cache: OrderedDict = OrderedDict()  # doc ID -> product
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm = None
+
+    def scan(self, keep: Optional[Callable[[int], bool]] = None) -> Iterator[Tuple[int, Dict]]:
+        """
+        Read the file once and register the records whose line number passes
+        keep (default: all). Yields (line number, product) for each of them,
+        in doc ID order, so that the caller can index them.
+        """
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line_number, line in enumerate(f):
+                start, offset = offset, offset + len(line)
+                self.line_count += 1
+                if keep is not None and not keep(line_number):
+                    continue
+                self._offsets.append(start)
+                yield line_number, json.loads(line)
+
+        self._file = open(self.path, "rb")
+        if offset:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def append(self, product: Dict) -> int:
+        """
+        Add a product that is not in the file. Returns its doc ID.
+        """
+        doc_id = len(self)
+        self._added[doc_id] = product
+        return doc_id
+
+    def _decode(self, doc_id: int) -> Dict:
+        start = self._offsets[doc_id]
+        end = self._mm.find(b"\n", start)
+        return json.loads(self._mm[start:end if end != -1 else len(self._mm)])
+
+    def __getitem__(self, doc_id: int) -> Dict:
+        if doc_id in self._added:
+            return self._added[doc_id]
+        if not 0 <= doc_id < len(self._offsets):
+            raise IndexError(doc_id)
+        with self._lock:
+            product = self._cache.get(doc_id)
+            if product is not None:
+                self._cache.move_to_end(doc_id)
+                return product
+        product = self._decode(doc_id)
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[doc_id] = product
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return product
+
+    def __len__(self) -> int:
+        return len(self._offsets) + len(self._added)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for doc_id in range(len(self)):
+            yield self[doc_id]
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
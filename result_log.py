@@ -0,0 +1,215 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    result_log.py                                      :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 21:47:03 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 21:47:03 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Log of search results, written in the background.
+
+Results are serialized by the caller and handed to a writer thread through a
+bounded queue; the thread appends them to gzip compressed JSONL segments and
+starts a new segment once max_segment_bytes (uncompressed) were written.
+When the queue is full, put() waits up to put_timeout seconds for room, then
+drops the result. Queued results are written when the log is closed, at the
+latest when the interpreter exits.
+
+A batch that cannot be written (OSError, e.g. a full disk) is counted as
+dropped and the next one starts a new segment. Should the writer thread
+stop anyway, put() drops records, and flush() and close() return instead
+of waiting for it.
+
+A segment is a regular .jsonl.gz file: read it with gzip.open(path, "rt").
+"""
+
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# Queued item telling the writer thread to stop
+_STOP = None
+
+# Most lines written (and compressed) together
+BATCH_SIZE = 256
+
+
+class ResultLog:
+    """
+    Rotating compressed JSONL log in directory, fed by put().
+    """
+
+    def __init__(self, directory: str, max_queue: int = 10000, max_segment_bytes: int = 64 << 20,
+                 put_timeout: float = 1.0, compresslevel: int = 6):
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.put_timeout = put_timeout
+        self.compresslevel = compresslevel
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        # Notified by the writer thread when records were handled or it stopped
+        self._progress = threading.Condition(self._lock)
+        self._pending = 0
+        self._closed = False
+        self._sequence = 0
+        self.segments: List[str] = []
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_error: Optional[OSError] = None
+
+        self._thread = threading.Thread(target=self._run, name="result-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, record: Dict) -> bool:
+        """
+        Queue a record. Returns False when it was dropped (queue still full
+        after put_timeout seconds, writer thread stopped, or log closed).
+        """
+        if self._closed:
+            return False
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            if not self._thread.is_alive():
+                self.dropped += 1
+                return False
+            self._pending += 1
+        try:
+            self._queue.put(line, timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending -= 1
+                self.dropped += 1
+            return False
+        return True
+
+    def flush(self) -> None:
+        """
+        Wait until every queued record is written and flushed (or dropped),
+        or the writer thread stopped.
+        """
+        with self._progress:
+            while self._pending and self._thread.is_alive():
+                self._progress.wait(0.1)
+
+    def _open_segment(self):
+        while True:
+            name = f"results-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}-{self._sequence:04d}.jsonl.gz"
+            self._sequence += 1
+            path = os.path.join(self.directory, name)
+            try:
+                segment = gzip.open(path, "xb", compresslevel=self.compresslevel)
+            except FileExistsError:
+                continue
+            self.segments.append(path)
+            return segment
+
+    @staticmethod
+    def _close_segment(segment) -> None:
+        try:
+            segment.close()
+        except OSError:
+            pass
+
+    def _run(self) -> None:
+        segment = None
+        segment_bytes = 0
+        stop = False
+        try:
+            while not stop:
+                batch = [self._queue.get()]
+                while len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+
+                lines = [line for line in batch if line is not _STOP]
+                stop = len(lines) < len(batch)
+                if not lines:
+                    continue
+                try:
+                    data = "".join(lines).encode("utf-8")
+                    if segment is None:
+                        segment = self._open_segment()
+                        segment_bytes = 0
+                    segment.write(data)
+                    segment_bytes += len(data)
+                    if segment_bytes >= self.max_segment_bytes:
+                        segment.close()
+                        segment = None
+                    elif self._queue.empty():
+                        # Idle: make what was written readable
+                        segment.flush()
+                except OSError as e:
+                    # Drop the batch; the next one goes to a new segment
+                    if segment is not None:
+                        self._close_segment(segment)
+                        segment = None
+                    with self._progress:
+                        self.dropped += len(lines)
+                        self.errors += 1
+                        self.last_error = e
+                        self._pending -= len(lines)
+                        self._progress.notify_all()
+                else:
+                    with self._progress:
+                        self.written += len(lines)
+                        self._pending -= len(lines)
+                        self._progress.notify_all()
+        finally:
+            if segment is not None:
+                self._close_segment(segment)
+            with self._progress:
+                self._progress.notify_all()
+
+    def close(self) -> None:
+        """
+        Write the queued records, then stop the writer thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        while self._thread.is_alive():
+            try:
+                self._queue.put(_STOP, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+        # Records a writer thread that stopped early did not handle
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        with self._lock:
+            self.dropped += self._pending
+            self._pending = 0
+        atexit.unregister(self.close)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"queued": self._queue.qsize(), "written": self.written,
+                    "dropped": self.dropped, "errors": self.errors, "segments": len(self.segments)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
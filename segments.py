@@ -0,0 +1,187 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    segments.py                                        :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 17:31:45 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 17:31:45 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Delta segments for incremental index updates (LSM style).
+
+A segment directory holds a MANIFEST.json and small JSONL segment files.
+Every line of a segment is an operation on one document, identified by URL:
+
+    {"seq": 12, "op": "upsert", "doc": {...product...}}
+    {"seq": 13, "op": "delete", "url": "https://..."}
+
+Sequence numbers are global and increasing, so an operation only applies if
+it is newer than the last one seen for the same URL. This makes applying a
+segment idempotent and lets compaction merge segments without changing what
+readers see. The manifest is replaced atomically; readers only need to watch
+its generation number.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are serialised
+    fcntl = None
+
+MANIFEST_FILE = "MANIFEST.json"
+LOCK_FILE = "LOCK"
+
+# Index directory SearchEngine searches by default, and the subfolder of an
+# index directory holding its segments
+DEFAULT_INDEX_PATH = "fichier_prof/"
+SEGMENT_DIR = "segments"
+
+
+def index_segment_path(index_path: str = DEFAULT_INDEX_PATH) -> str:
+    """Segment directory of an index directory, where writers and SearchEngine meet."""
+    return os.path.join(index_path, SEGMENT_DIR)
+
+# One lock per segment directory, shared by every SegmentStore of the process
+_directory_locks: Dict[str, threading.Lock] = {}
+_directory_locks_guard = threading.Lock()
+
+
+class SegmentStore:
+    """
+    Writer and reader of a segment directory.
+
+    Writes and compactions are serialised by a per-directory lock (a thread
+    lock plus an flock on the LOCK file where available, so that separate
+    processes can write too). Reading needs no lock.
+    """
+
+    def __init__(self, path: str, max_segments: int = 8, create: bool = True):
+        self.path = path
+        self.max_segments = max_segments
+        if create:
+            os.makedirs(path, exist_ok=True)
+
+    @contextmanager
+    def _locked(self):
+        key = os.path.realpath(self.path)
+        with _directory_locks_guard:
+            lock = _directory_locks.setdefault(key, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.path, LOCK_FILE), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read_manifest(self) -> Dict:
+        """Current manifest, or an empty one when nothing has been written yet."""
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"generation": 0, "next_seq": 1, "next_segment": 1, "segments": []}
+
+    def _write_manifest(self, manifest: Dict) -> None:
+        manifest["generation"] += 1
+        tmp_path = os.path.join(self.path, f"{MANIFEST_FILE}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, os.path.join(self.path, MANIFEST_FILE))
+
+    def _write_segment_file(self, name: str, ops: List[Dict]) -> None:
+        tmp_path = os.path.join(self.path, f"{name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            for op in ops:
+                file.write(json.dumps(op, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def write_segment(self, changes: List[Dict]) -> Optional[str]:
+        """
+        Write a new segment from changes ({"op": "upsert", "doc": ...} or
+        {"op": "delete", "url": ...}), numbering them. Returns its name.
+        """
+        if not changes:
+            return None
+        with self._locked():
+            manifest = self.read_manifest()
+            ops = []
+            for change in changes:
+                ops.append({"seq": manifest["next_seq"], **change})
+                manifest["next_seq"] += 1
+            name = f"seg_{manifest['next_segment']:06d}.jsonl"
+            manifest["next_segment"] += 1
+            self._write_segment_file(name, ops)
+            manifest["segments"].append(name)
+            self._write_manifest(manifest)
+        return name
+
+    def upsert(self, docs: List[Dict]) -> Optional[str]:
+        return self.write_segment([{"op": "upsert", "doc": doc} for doc in docs])
+
+    def delete(self, urls: List[str]) -> Optional[str]:
+        return self.write_segment([{"op": "delete", "url": url} for url in urls])
+
+    def iter_ops(self, name: str) -> Iterator[Dict]:
+        """Operations of a segment, in sequence order."""
+        with open(os.path.join(self.path, name), "r", encoding="utf-8") as file:
+            for line in file:
+                yield json.loads(line)
+
+    def compact(self) -> bool:
+        """
+        Merge every segment into one, keeping only the newest operation per
+        URL. Returns True when a merge happened.
+        """
+        with self._locked():
+            manifest = self.read_manifest()
+            merged_names = list(manifest["segments"])
+            if len(merged_names) < 2:
+                return False
+
+            latest: Dict[str, Dict] = {}
+            for name in merged_names:
+                for op in self.iter_ops(name):
+                    url = op["doc"]["url"] if op["op"] == "upsert" else op["url"]
+                    if url not in latest or latest[url]["seq"] < op["seq"]:
+                        latest[url] = op
+            ops = sorted(latest.values(), key=lambda op: op["seq"])
+
+            name = f"seg_{manifest['next_segment']:06d}.jsonl"
+            manifest["next_segment"] += 1
+            self._write_segment_file(name, ops)
+            manifest["segments"] = [name]
+            self._write_manifest(manifest)
+
+        # Readers that still list the old segments reload the manifest on failure
+        for old_name in merged_names:
+            try:
+                os.remove(os.path.join(self.path, old_name))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def merge_in_background(self) -> Optional[threading.Thread]:
+        """Start a compaction thread when there are more than max_segments segments."""
+        if len(self.read_manifest()["segments"]) <= self.max_segments:
+            return None
+        thread = threading.Thread(target=self.compact, name="segment-merge")
+        thread.start()
+        return thread
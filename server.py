@@ -0,0 +1,267 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    server.py                                          :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 22:36:18 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 22:36:18 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+HTTP query service keeping one search engine loaded.
+
+    python server.py --index fichier_prof/ --port 8080
+    curl 'http://127.0.0.1:8080/search?q=black+shirt&type=all&k=5'
+
+Endpoints (GET, JSON responses):
+    /search?q=&type=&k=&window=   SearchEngine.search (type: any, all, exact)
+        &brand=&made_in=          filters, comma separated values
+        &min_rating=&min_reviews=
+        &facets=1                 counts of brands, origins and ratings
+    /stats                        request counters, result cache and query metrics
+    /metrics                      query metrics in the Prometheus text format
+    /health                       200 once the engine is loaded
+
+Connections are served concurrently by asyncio; the engine is not thread
+safe, so searches run one at a time in a worker thread. A search that takes
+longer than request_timeout seconds gets a 504 response: a search already
+running finishes in the background and its result is cached, one still
+waiting for the worker thread is cancelled.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from segments import DEFAULT_INDEX_PATH
+
+SEARCH_TYPES = ('any', 'all', 'exact')
+
+# Largest request head accepted, in bytes
+MAX_HEADER_BYTES = 16384
+
+
+class QueryServer:
+    """
+    Serves an engine with SearchEngine's search() over HTTP.
+    """
+
+    def __init__(self, engine, host: str = "127.0.0.1", port: int = 8080,
+                 request_timeout: float = 10.0, keep_alive_timeout: float = 15.0):
+        self.engine = engine
+        self.host = host
+        self.port = port
+        self.request_timeout = request_timeout
+        self.keep_alive_timeout = keep_alive_timeout
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search")
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.started_at = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.in_flight = 0
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES)
+        # Port 0 picks a free port: report the real one
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(wait=True)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keep_alive_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                        {"error": "request head too large"}, keep_alive=False)
+                    return
+
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ")
+                except ValueError:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, {"error": "malformed request line"},
+                                        keep_alive=False)
+                    return
+                headers = {name.strip().lower(): value.strip()
+                           for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and (version == "HTTP/1.1" or headers.get("connection", "").lower() == "keep-alive"))
+
+                if method != "GET":
+                    status, body = HTTPStatus.METHOD_NOT_ALLOWED, {"error": "only GET is supported"}
+                else:
+                    status, body = await self.dispatch(target)
+                await self._respond(writer, status, body, keep_alive)
+                if not keep_alive:
+                    return
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: HTTPStatus, body: Any,
+                       keep_alive: bool) -> None:
+        if isinstance(body, str):
+            data, content_type = body.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            data, content_type = json.dumps(body, ensure_ascii=False).encode("utf-8"), "application/json"
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+        await writer.drain()
+
+    async def dispatch(self, target: str) -> Tuple[HTTPStatus, Any]:
+        """
+        Answer one request. Returns its status and body (dict: JSON, str: text).
+        """
+        self.requests += 1
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            if url.path == "/search":
+                return await self._search(params)
+            if url.path == "/stats":
+                return HTTPStatus.OK, self.stats()
+            if url.path == "/metrics" and hasattr(self.engine, "metrics"):
+                return HTTPStatus.OK, self.engine.metrics.to_prometheus()
+            if url.path == "/health":
+                return HTTPStatus.OK, {"status": "ok"}
+            return HTTPStatus.NOT_FOUND, {"error": f"unknown path {url.path}"}
+        except ValueError as e:
+            self.errors += 1
+            return HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            return HTTPStatus.GATEWAY_TIMEOUT, {"error": f"search took more than {self.request_timeout} s"}
+        except Exception as e:
+            self.errors += 1
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(e).__name__}: {e}"}
+
+    async def _search(self, params: Dict[str, str]) -> Tuple[HTTPStatus, Dict]:
+        query = params.get("q", "").strip()
+        if not query:
+            raise ValueError("missing query parameter q")
+        search_type = params.get("type", "any")
+        if search_type not in SEARCH_TYPES:
+            raise ValueError(f"type must be one of {', '.join(SEARCH_TYPES)}")
+        try:
+            k = int(params["k"]) if "k" in params else 10
+            window = int(params.get("window", 1))
+        except ValueError:
+            raise ValueError("k and window must be integers")
+        if k < 0 or window < 1:
+            raise ValueError("k must be >= 0 and window >= 1")
+
+        filters = {name: [value.strip() for value in params[name].split(",") if value.strip()]
+                   for name in ("brand", "made_in") if name in params}
+        try:
+            if "min_rating" in params:
+                filters["min_rating"] = float(params["min_rating"])
+            if "min_reviews" in params:
+                filters["min_reviews"] = int(params["min_reviews"])
+        except ValueError:
+            raise ValueError("min_rating must be a number and min_reviews an integer")
+        facets = params.get("facets", "0").lower() in ("1", "true", "yes")
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        try:
+            future = self._executor.submit(lambda: self.engine.search(
+                query, search_type, k=k, phrase_window=window, filters=filters, facets=facets))
+            # shield: on timeout a running search goes on and fills the result
+            # cache, while one still queued behind others is dropped
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.shield(asyncio.wrap_future(future, loop=loop)), self.request_timeout)
+            except asyncio.TimeoutError:
+                if future.cancel():
+                    self.cancelled += 1
+                raise
+        finally:
+            self.in_flight -= 1
+        return HTTPStatus.OK, results
+
+    def stats(self) -> Dict:
+        stats = {
+            "server": {"uptime_s": time.time() - self.started_at, "requests": self.requests,
+                       "errors": self.errors, "timeouts": self.timeouts,
+                       "cancelled": self.cancelled, "in_flight": self.in_flight},
+        }
+        engine = self.engine
+        if hasattr(engine, "doc_ids"):
+            stats["engine"] = {"documents": len(engine.doc_ids), "index_version": engine.index_version}
+        if hasattr(engine, "result_cache"):
+            stats["result_cache"] = engine.result_cache.stats()
+        if hasattr(engine, "metrics"):
+            stats["queries"] = engine.metrics.to_dict()
+        return stats
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="HTTP query service keeping one search engine loaded.")
+    parser.add_argument("--index", default=DEFAULT_INDEX_PATH, help="index directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--timeout", type=float, default=10.0, help="request timeout, in seconds")
+    parser.add_argument("--shards", type=int, default=0, help="serve a ShardedSearchEngine with this many shards")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.shards:
+        from sharding import ShardedSearchEngine
+        engine = ShardedSearchEngine(args.index, num_shards=args.shards)
+    else:
+        from tp3 import SearchEngine
+        engine = SearchEngine(args.index)
+    print(f"Engine loaded in {time.perf_counter() - start:.2f} s")
+
+    server = QueryServer(engine, args.host, args.port, args.timeout)
+
+    async def serve():
+        await server.start()
+        print(f"Listening on http://{server.host}:{server.port}")
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.close()
+
+
+if __name__ == "__main__":
+    main()
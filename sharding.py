@@ -0,0 +1,247 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    sharding.py                                        :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 18:05:12 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 18:05:12 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Scatter-gather search over a collection partitioned by doc ID.
+
+Each shard is a SearchEngine holding the products of one partition, with
+only their postings and reviews, running in its own process (or in the
+coordinator's process with processes=False).
+A query takes two round trips, sent to every shard before any reply is read
+so that shards work in parallel:
+
+    1. every shard reports its collection statistics (document count,
+       lengths, document frequencies of the query terms), which the
+       coordinator adds up;
+    2. every shard ranks its own top-k with these global statistics, so
+       IDF and length normalization are those of the whole collection.
+
+The per-shard top-k lists are then merged on (score, global doc ID), giving
+the same ranking as a single SearchEngine over the whole collection.
+"""
+
+import multiprocessing
+import os
+from collections import Counter
+from datetime import datetime
+from heapq import merge
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+from segments import DEFAULT_INDEX_PATH
+from tp3 import SearchEngine
+
+
+def _serve_shard(connection, index_path: str, shard_id: int, num_shards: int,
+                 segment_path: Optional[str], refresh_interval: float) -> None:
+    """
+    Shard process: load one partition, then answer (method, args) calls
+    until the coordinator closes the connection.
+    """
+    try:
+        engine = SearchEngine(index_path, segment_path, refresh_interval, shard=(shard_id, num_shards))
+    except Exception as e:
+        connection.send(("error", e))
+        return
+    connection.send(("ok", None))
+
+    while True:
+        try:
+            method, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            connection.send(("ok", getattr(engine, method)(*args)))
+        except Exception as e:
+            connection.send(("error", e))
+
+
+class ProcessShard:
+    """
+    A shard running in a child process, called through a pipe (a socket
+    pair on Unix).
+    """
+
+    def __init__(self, index_path: str, shard_id: int, num_shards: int,
+                 segment_path: Optional[str] = None, refresh_interval: float = 1.0):
+        self._connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve_shard, name=f"shard-{shard_id}", daemon=True,
+            args=(child_connection, index_path, shard_id, num_shards, segment_path, refresh_interval))
+        self.process.start()
+        child_connection.close()
+        # Wait until the shard is loaded, raising its error if it failed
+        self.receive()
+
+    def send(self, method: str, *args) -> None:
+        self._connection.send((method, args))
+
+    def receive(self) -> Any:
+        status, value = self._connection.recv()
+        if status == "error":
+            raise value
+        return value
+
+    def close(self) -> None:
+        self._connection.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+class LocalShard:
+    """
+    A shard held by the coordinator's process, with the same interface as
+    ProcessShard (calls run when sent).
+    """
+
+    def __init__(self, index_path: str, shard_id: int, num_shards: int,
+                 segment_path: Optional[str] = None, refresh_interval: float = 1.0):
+        self.engine = SearchEngine(index_path, segment_path, refresh_interval, shard=(shard_id, num_shards))
+        self._result = None
+
+    def send(self, method: str, *args) -> None:
+        self._result = getattr(self.engine, method)(*args)
+
+    def receive(self) -> Any:
+        result, self._result = self._result, None
+        return result
+
+    def close(self) -> None:
+        pass
+
+
+def merge_statistics(shard_stats: List[Dict]) -> Dict:
+    """
+    Add up the collection statistics of every shard.
+    """
+    doc_freqs = Counter()
+    for stats in shard_stats:
+        doc_freqs.update(stats['doc_freqs'])
+    return {
+        'doc_count': sum(stats['doc_count'] for stats in shard_stats),
+        'total_length': sum(stats['total_length'] for stats in shard_stats),
+        'length_count': sum(stats['length_count'] for stats in shard_stats),
+        'doc_freqs': dict(doc_freqs),
+    }
+
+
+def merge_facets(shard_facets: List[Dict[str, Dict[str, int]]]) -> Dict[str, Dict[str, int]]:
+    """
+    Add up the facet counts of every shard, most frequent values first.
+    """
+    merged: Dict[str, Counter] = {}
+    for facets in shard_facets:
+        for facet, counts in facets.items():
+            merged.setdefault(facet, Counter()).update(counts)
+    return {facet: dict(sorted(counts.items(), key=lambda item: (-item[1], item[0])))
+            for facet, counts in merged.items()}
+
+
+class ShardedSearchEngine:
+    """
+    Coordinator of num_shards SearchEngine shards, with the same search()
+    as SearchEngine.
+    """
+
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH, num_shards: Optional[int] = None,
+                 segment_path: Optional[str] = None, refresh_interval: float = 1.0,
+                 processes: bool = True):
+        """
+        Start the shards (one per CPU by default). With processes=False they
+        are loaded in this process, which is mostly useful for debugging.
+        """
+        self.num_shards = num_shards or os.cpu_count() or 1
+        shard_class = ProcessShard if processes else LocalShard
+        self.shards = []
+        self.result_log = None
+        try:
+            for shard_id in range(self.num_shards):
+                self.shards.append(shard_class(index_path, shard_id, self.num_shards,
+                                               segment_path, refresh_interval))
+        except Exception:
+            self.close()
+            raise
+
+        base_path = os.path.dirname(index_path.rstrip('/'))
+        self.results_dir = os.path.join(base_path, "search_results")
+
+    def _broadcast(self, method: str, *args) -> List[Any]:
+        """
+        Call a SearchEngine method on every shard and return their results.
+        """
+        for shard in self.shards:
+            shard.send(method, *args)
+        return [shard.receive() for shard in self.shards]
+
+    def search(self, query: str, search_type: str = 'any', save_results: bool = False,
+               k: Optional[int] = None, phrase_window: int = 1,
+               filters: Optional[Dict] = None, facets: bool = False) -> Dict:
+        """
+        Search every shard and merge their results (see SearchEngine.search).
+        """
+        stats = merge_statistics(self._broadcast('collection_statistics', query))
+        # Shards share the origin synonyms: any of them normalizes the filters
+        normalized_filters = ()
+        if filters:
+            self.shards[0].send('normalize_filters', filters)
+            normalized_filters = self.shards[0].receive()
+        shard_results = self._broadcast('search_shard', query, search_type, k, stats, phrase_window,
+                                        normalized_filters, facets)
+
+        ranked = merge(*(shard['results'] for shard in shard_results),
+                       key=lambda item: (-item[0], item[1]))
+        ranked_docs = [result for _, _, result in islice(ranked, k)]
+
+        results = {
+            'metadata': {
+                'query': query,
+                'search_type': search_type,
+                'timestamp': datetime.now().isoformat(),
+                'total_documents': stats['doc_count'],
+                'filtered_documents': sum(shard['filtered_documents'] for shard in shard_results),
+                'k': k,
+                # Oldest segment generation any shard has applied
+                'index_version': min(shard['index_version'] for shard in shard_results),
+                'shards': self.num_shards
+            },
+            'results': ranked_docs
+        }
+        if normalized_filters:
+            results['metadata']['filters'] = {name: list(value) if isinstance(value, tuple) else value
+                                              for name, value in normalized_filters}
+        if facets:
+            results['facets'] = merge_facets([shard['facets'] for shard in shard_results])
+
+        if save_results:
+            self._save_search_results(results)
+
+        return results
+
+    _save_search_results = SearchEngine._save_search_results
+
+    def close(self) -> None:
+        """
+        Stop the shard processes and write the queued results.
+        """
+        for shard in self.shards:
+            shard.close()
+        self.shards = []
+        if self.result_log is not None:
+            self.result_log.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -11,271 +11,1399 @@
 # **************************************************************************** #
 
 
+import bisect
+import heapq
 import json
 import math
 import re
 import os
+import time
+import zlib
+from collections import Counter
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Dict, List, Set, Tuple
-
-# STOPWORDS
-STOPWORDS = {
-    "i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you", "your", 
-    "yours", "yourself", "yourselves", "he", "him", "his", "himself", "she", 
-    "her", "hers", "herself", "it", "its", "itself", "they", "them", "their", 
-    "theirs", "themselves", "what", "which", "who", "whom", "this", "that", 
-    "these", "those", "am", "is", "are", "was", "were", "be", "been", "being", 
-    "have", "has", "had", "having", "do", "does", "did", "doing", "a", "an", 
-    "the", "and", "but", "if", "or", "because", "as", "until", "while", "of", 
-    "at", "by", "for", "with", "about", "against", "between", "into", "through", 
-    "during", "before", "after", "above", "below", "to", "from", "up", "down", 
-    "in", "out", "on", "off", "over", "under", "again", "further", "then", 
-    "once", "here", "there", "when", "where", "why", "how", "all", "any", 
-    "both", "each", "few", "more", "most", "other", "some", "such", "no", 
-    "nor", "not", "only", "own", "same", "so", "than", "too", "very", "s", 
-    "t", "can", "will", "just", "don", "should", "now"
-}
+from typing import Callable, Container, ContextManager, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # every query is then scored document by document
+    np = None
+
+import bitmap
+from analyzer import ANALYZER_VERSION, Analyzer
+from index_format import RemappedIndex, open_index
+from product_store import ProductStore
+from result_cache import LRUDict, ResultCache
+from result_log import ResultLog
+from segments import DEFAULT_INDEX_PATH, SegmentStore, index_segment_path
+from tracing import QueryTrace, SearchMetrics, profile_block
+
+# Ranking components, in the order they are computed
+SCORE_COMPONENTS = (
+    'bm25_score', 'exact_match_score', 'review_score',
+    'title_match_score', 'origin_match_score', 'proximity_score'
+)
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Largest values the query independent bonuses can take
+EXACT_MATCH_BONUS = 2.0
+ORIGIN_MATCH_BONUS = 0.1
+
+# Weight of the terms added by synonym expansion, query terms weigh 1
+SYNONYM_WEIGHT = 0.5
+
+# Proximity: bonus when every pair of consecutive query terms appears at most
+# PROXIMITY_WINDOW positions apart, in this order, in the title or description
+PROXIMITY_BONUS = 0.3
+PROXIMITY_WINDOW = 3
+
+# Default number of terms kept by each per-term cache of the engine
+TERM_CACHE_SIZE = 4096
+
+# Candidate count from which documents are scored together in NumPy arrays
+VECTORIZED_MIN_CANDIDATES = 1000
+
+# Fields with positional indexes
+POSITION_FIELDS = ('title', 'description')
+
+# Quoted phrases of a query
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+# Analyzer settings written by create_index.run next to the indexes
+INDEX_META_FILE = "index_meta.json"
+
+# Structured filters of search(filters=...), and the facets counted per result set
+FILTER_NAMES = ('brand', 'made_in', 'min_rating', 'min_reviews')
+FACETS = ('brand', 'made_in', 'rating')
+
+
+def gallop_right(positions: List[int], target: int, lo: int = 0) -> int:
+    """
+    bisect_right(positions, target, lo) found by galloping: the search range
+    doubles from lo before the binary search, so that walking a long list by
+    small steps costs O(log(step)) per step.
+    """
+    step = 1
+    hi = lo
+    while hi < len(positions) and positions[hi] <= target:
+        lo = hi + 1
+        hi += step
+        step *= 2
+    return bisect.bisect_right(positions, target, lo, min(hi, len(positions)))
+
+
+def follow_positions(previous: List[int], positions: List[int], window: int) -> List[int]:
+    """
+    Positions (sorted) that come 1 to window places after one of the
+    previous ones (sorted): where a phrase continues with the next term.
+    """
+    result = []
+    start = 0
+    for position in previous:
+        start = gallop_right(positions, position, start)
+        end = gallop_right(positions, position + window, start)
+        result.extend(positions[start:end])
+        start = end
+    return result
+
 
 class SearchEngine:
-    def __init__(self, index_path: str = "fichier_prof/"):
-        """Initialize the search engine by loading all required indexes."""
-        # Load all indexes from the provided path
-        with open(f"{index_path}brand_index.json", "r") as f:
-            self.brand_index = json.load(f)
-        with open(f"{index_path}description_index.json", "r") as f:
-            self.description_index = json.load(f)
-        with open(f"{index_path}domain_index.json", "r") as f:
-            self.domain_index = json.load(f)
-        with open(f"{index_path}origin_index.json", "r") as f:
-            self.origin_index = json.load(f)
+    def __init__(self, index_path: str = DEFAULT_INDEX_PATH, segment_path: Optional[str] = None,
+                 refresh_interval: float = 1.0, shard: Optional[Tuple[int, int]] = None,
+                 cache_size: int = 1024, cache_ttl: float = 300.0, product_cache_size: int = 256,
+                 term_cache_size: int = TERM_CACHE_SIZE):
+        """
+        Initialize the search engine by loading all required indexes.
+
+        Delta segments written by create_index.run_incremental in segment_path
+        (default: <index_path>segments, see segments.index_segment_path) are
+        applied on top of them, and checked again every refresh_interval
+        seconds while searching.
+
+        With shard=(shard_id, num_shards) only the products of that shard are
+        loaded: line number % num_shards for rearranged_products.jsonl, and
+        the CRC32 of the URL for documents added by segments (see sharding.py).
+
+        Up to cache_size search results are cached for cache_ttl seconds
+        (cache_size=0 disables the cache).
+
+        Products are decoded from rearranged_products.jsonl when results are
+        rendered; the last product_cache_size ones are kept (see ProductStore).
+
+        Data derived from the indexes term by term is cached for the
+        term_cache_size most recently used terms (see LRUDict).
+        """
+        self.term_cache_size = term_cache_size
+        self.shard_id, self.num_shards = shard or (0, 1)
+
+        # Analyze text like the indexes were built (default analyzer without metadata)
+        self.index_meta = self._load_index_meta(index_path)
+        self.analyzer = Analyzer.from_metadata(self.index_meta)
+
         with open(f"{index_path}origin_synonyms.json", "r") as f:
             self.origin_synonyms = json.load(f)
+        self.synonym_expansions: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+        self.max_synonym_length = 0
+        self.compile_synonyms(self.origin_synonyms)
         with open(f"{index_path}reviews_index.json", "r") as f:
             self.reviews_index = json.load(f)
-        with open(f"{index_path}title_index.json", "r") as f:
-            self.title_index = json.load(f)
 
-        # Load product data
-        self.products = {}
-        with open(f"{index_path}rearranged_products.jsonl", "r") as f:
-            for line in f:
-                product = json.loads(line)
-                self.products[product["url"]] = product
+        # Product data is read once; documents are identified by their line
+        # number (global_doc_ids keeps that number when the engine holds one shard)
+        self.products = ProductStore(f"{index_path}rearranged_products.jsonl", product_cache_size)
+        self.doc_urls: List[str] = []
+        self.doc_ids: Dict[str, int] = {}
+        self.global_doc_ids: List[int] = []
+        self._token_bitmaps: Dict[str, int] = LRUDict(term_cache_size)
+
+        # Incremental updates: documents added by segments get new doc IDs,
+        # replaced or deleted ones are masked out by the deleted bitmap.
+        # delta_doc_freqs is the change of each term's document frequency
+        # since the base indexes (negative when documents were masked out)
+        self.deleted = 0
+        self.delta_token_docs: Dict[str, List[int]] = {}
+        self.delta_doc_freqs: Counter = Counter()
+        self.delta_positions: Dict[str, Dict[str, Dict[int, List[int]]]] = {
+            field: {} for field in POSITION_FIELDS}
+        self._doc_seqs: Dict[str, int] = {}
+
+        # Precompute the document statistics used by the ranking functions
+        # (lengths written by create_index, when present, save tokenizing)
+        self._build_term_statistics(self._load_products(), self._load_doc_lengths(index_path))
+        self.base_doc_count = self.products.line_count
+        self.base_doc_ids = dict(self.doc_ids)
+
+        # Load all indexes from the provided path (binary indexes are memory-mapped),
+        # with their postings by doc ID of this engine (see RemappedIndex).
+        # A shard only keeps the postings and reviews of its own documents;
+        # document frequencies of the whole collection come from the
+        # coordinator (use_collection_statistics)
+        keep = self.base_doc_ids if self.num_shards > 1 else None
+        doc_tables = {}
+        self.brand_index = self._load_postings(index_path, "brand_index", keep, doc_tables)
+        self.description_index = self._load_postings(index_path, "description_index", keep, doc_tables)
+        self.domain_index = self._load_index(index_path, "domain_index")
+        self.origin_index = self._load_postings(index_path, "origin_index", keep, doc_tables)
+        self.title_index = self._load_postings(index_path, "title_index", keep, doc_tables)
+        if keep is not None:
+            self.reviews_index = {url: review_data for url, review_data in self.reviews_index.items()
+                                  if url in keep}
+
+        self._applied_segments: Set[str] = set()
+        self.index_version = 0
+        self.segments = SegmentStore(segment_path or index_segment_path(index_path), create=False)
+        self.refresh_interval = refresh_interval
+        self._last_refresh_check = float("-inf")
+        self.result_cache = ResultCache(cache_size, cache_ttl)
+        self.refresh()
+
+        # Stage timings of every query; profile_hook(query, search_type), when
+        # set, returns a context manager each search runs in (e.g. a sampling profiler)
+        self.metrics = SearchMetrics()
+        self.profile_hook: Optional[Callable[[str, str], ContextManager]] = None
 
-        # Create results directory if it doesn't exist
+        # Saved results are logged in the background, started on first use
         base_path = os.path.dirname(index_path.rstrip('/'))
         self.results_dir = os.path.join(base_path, "search_results")
-        os.makedirs(self.results_dir, exist_ok=True)
+        self.result_log: Optional[ResultLog] = None
+
+    @staticmethod
+    def _load_index(index_path: str, name: str, keep: Optional[Container[str]] = None):
+        """
+        Open an index, preferring the binary format when it has been built.
+        With keep (URLs), only the postings of those documents are parsed
+        from a JSON index (binary ones are memory-mapped whole).
+        """
+        binary_path = f"{index_path}{name}.bin"
+        if os.path.exists(binary_path):
+            return open_index(binary_path)
+        return open_index(f"{index_path}{name}.json", keep)
+
+    def _load_postings(self, index_path: str, name: str, keep: Optional[Container[str]],
+                       doc_tables: Dict) -> RemappedIndex:
+        """
+        Open a posting index with its documents mapped to the base doc IDs
+        once and for all (doc_tables keeps the mapping of a binary doc table
+        shared by several indexes).
+        """
+        return RemappedIndex(self._load_index(index_path, name, keep), self.base_doc_ids, doc_tables)
+
+    @staticmethod
+    def _load_index_meta(index_path: str) -> Optional[Dict]:
+        """
+        Analyzer settings of the indexes, warning when they were built by
+        another analyzer version (their terms may not match the queries').
+        """
+        meta_path = f"{index_path}{INDEX_META_FILE}"
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, "r") as f:
+            index_meta = json.load(f)
+        if index_meta.get("analyzer_version") != ANALYZER_VERSION:
+            print(f"Warning: indexes of {index_path} were built with analyzer version "
+                  f"{index_meta.get('analyzer_version')}, searching with version {ANALYZER_VERSION}")
+        return index_meta
 
     def tokenize_text(self, text: str) -> List[str]:
         """
-        Tokenize text using regex, remove numbers, and preserve hyphenated words.
+        Tokenize text like the indexer (see analyzer.py), stopwords included.
+        """
+        return self.analyzer.tokenize(text)
+
+    def _load_products(self) -> Iterator[Tuple[int, Dict]]:
+        """
+        Register the products of this shard and yield them with their doc ID.
+        """
+        for line_number, product in self.products.scan(lambda n: n % self.num_shards == self.shard_id):
+            doc_id = len(self.doc_urls)
+            self.doc_ids[product["url"]] = doc_id
+            self.doc_urls.append(product["url"])
+            self.global_doc_ids.append(line_number)
+            yield doc_id, product
+
+    @staticmethod
+    def _load_doc_lengths(index_path: str) -> Dict[str, int]:
+        """
+        Length of every document by URL, as written by create_index
+        (empty when the indexes come without it).
+        """
+        lengths_path = f"{index_path}lengths_index.json"
+        if not os.path.exists(lengths_path):
+            return {}
+        with open(lengths_path, "r") as f:
+            return json.load(f)
+
+    def _build_term_statistics(self, products: Iterable[Tuple[int, Dict]], doc_lengths: Dict[str, int]) -> None:
+        """
+        Store the length of every product (from doc_lengths, by URL, or by
+        tokenizing it) and its exact match and facet values. Term frequencies
+        and title terms are read from the positional indexes (term_freqs).
+        """
+        self.doc_lengths: List[int] = []
+        # Normalized field value -> doc IDs, for exact matching
+        self.exact_titles: Dict[str, List[int]] = {}
+        self.exact_brands: Dict[str, List[int]] = {}
+        self.exact_origins: Dict[str, List[int]] = {}
+        self.doc_origins: List[Optional[str]] = []
+        # Normalized brand and origin of each document, for filters and facets
+        self.doc_facets: Dict[str, List[Optional[str]]] = {'brand': [], 'made_in': []}
+
+        for doc_id, product in products:
+            self._add_doc_length(product, doc_lengths.get(product['url']))
+            self._add_exact_values(doc_id, product)
+        self._update_collection_statistics()
+
+    def _add_doc_length(self, product: Dict, length: Optional[int] = None) -> None:
+        """
+        Record the length of one product: its number of title and description
+        terms, stopwords included. Tokenizes it unless length is given.
+        """
+        if length is None:
+            length = sum(map(len, self.analyzer.tokenize_many((product['title'], product['description']))))
+        self.doc_lengths.append(length)
+
+    def _add_exact_values(self, doc_id: int, product: Dict) -> None:
         """
-        return [token for token in re.findall(r'\b\w+(?:-\w+)*\b', text.lower()) if any(c.isalpha() for c in token)]
+        Record the normalized title, brand and origin of one product, its
+        lowercased origin for the origin match score and its facet values.
+        """
+        features = product.get('product_features', {})
+        origin = features.get('made in')
+        self.doc_origins.append(origin.lower() if origin is not None else None)
+        for facet, value in (('brand', features.get('brand')), ('made_in', origin)):
+            self.doc_facets[facet].append(value.lower().strip() if isinstance(value, str) else None)
+        fields = ((self.exact_titles, product['title']),
+                  (self.exact_brands, product.get('brand')),
+                  (self.exact_origins, product.get('product_features', {}).get('made in')))
+        for values, value in fields:
+            if value is not None:
+                values.setdefault(value.lower().strip(), []).append(doc_id)
+
+    def _update_collection_statistics(self) -> None:
+        """
+        Recompute the statistics that depend on the whole collection and reset
+        the caches derived from them.
+        """
+        self._total_length = sum(self.doc_lengths)
+        self.avg_doc_length = self._total_length / len(self.doc_lengths) if self._total_length else 1.0
+        self.collection_doc_count = len(self.doc_ids)
+        # Document frequencies of the whole collection, by term, when a shard
+        # scores with global statistics (None: the local ones)
+        self.collection_doc_freqs: Optional[Dict[str, int]] = None
+        self._collection_stats: Optional[Tuple[int, float, int]] = None
+        self._idf_cache: Dict[str, float] = LRUDict(self.term_cache_size)
+        self._term_bound_cache: Dict[str, float] = LRUDict(self.term_cache_size)
+        self._token_bitmaps = LRUDict(self.term_cache_size)
+        self._term_positions: Dict[Tuple[str, str], Dict[int, List[int]]] = LRUDict(self.term_cache_size)
+        self._term_freqs: Dict[str, Dict[int, int]] = LRUDict(self.term_cache_size)
+        self._static_array = None
+        self._length_norms = None
+        self._term_arrays: Dict[str, Tuple] = LRUDict(self.term_cache_size)
+        self.origin_values = set(self.doc_origins)
+        self._facet_bitmaps: Optional[Dict[str, Dict[str, int]]] = None
+        self._review_arrays: Dict[str, Tuple[List[float], List[int]]] = {}
+        self._threshold_bitmaps: Dict[Tuple[str, float], int] = {}
+
+        # Review score does not depend on the query: compute it once and keep
+        # the documents ordered by it for top-k early termination
+        self.static_scores = [
+            self.compute_review_score(doc_id) for doc_id in range(len(self.products))]
+        ordered = sorted(range(len(self.products)), key=lambda doc_id: -self.static_scores[doc_id])
+        self.static_rank = [0] * len(ordered)
+        for rank, doc_id in enumerate(ordered):
+            self.static_rank[doc_id] = rank
+
+    def collection_statistics(self, query: Optional[str] = None) -> Dict:
+        """
+        Statistics of the documents held by this engine that IDF and length
+        normalization depend on, with the document frequency of every term
+        of the query. Shards add them up into global statistics.
+        """
+        self.refresh()
+        terms = self.analyze_query(query) if query else ()
+        return {
+            'doc_count': len(self.doc_ids),
+            'total_length': self._total_length,
+            'length_count': len(self.doc_lengths),
+            'doc_freqs': {term: self.doc_freq(term) for term in terms},
+        }
+
+    def use_collection_statistics(self, stats: Dict) -> None:
+        """
+        Score with statistics of the whole collection instead of the local
+        ones, so that every shard ranks exactly like a single engine would.
+        Document frequencies received for earlier queries are kept until the
+        collection changes.
+        """
+        collection = (stats['doc_count'], stats['total_length'], stats['length_count'])
+        if collection != self._collection_stats or self.collection_doc_freqs is None:
+            self._collection_stats = collection
+            self.collection_doc_count = stats['doc_count']
+            self.avg_doc_length = stats['total_length'] / stats['length_count'] if stats['total_length'] else 1.0
+            self.collection_doc_freqs = {}
+            self._idf_cache = LRUDict(self.term_cache_size)
+            self._term_bound_cache = LRUDict(self.term_cache_size)
+            self._length_norms = None
+        for term, doc_count in stats['doc_freqs'].items():
+            if self.collection_doc_freqs.get(term) != doc_count:
+                self.collection_doc_freqs[term] = doc_count
+                self._idf_cache.pop(term, None)
+                self._term_bound_cache.pop(term, None)
+
+    def owns_url(self, url: str) -> bool:
+        """
+        Whether a document added by a segment belongs to this shard.
+        """
+        return zlib.crc32(url.encode("utf-8")) % self.num_shards == self.shard_id
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        Apply the delta segments written since the last check.
+        Returns True when documents were added, updated or deleted.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_refresh_check < self.refresh_interval:
+            return False
+        self._last_refresh_check = now
+
+        manifest = self.segments.read_manifest()
+        if manifest["generation"] == self.index_version:
+            return False
+
+        changed = False
+        complete = True
+        for name in manifest["segments"]:
+            if name in self._applied_segments:
+                continue
+            try:
+                ops = list(self.segments.iter_ops(name))
+            except FileNotFoundError:
+                # Merged away in the meantime: the next check reads the new manifest
+                complete = False
+                break
+            for op in ops:
+                changed |= self._apply_segment_op(op)
+            self._applied_segments.add(name)
+
+        if complete:
+            self.index_version = manifest["generation"]
+        if changed:
+            self._update_collection_statistics()
+            self.result_cache.clear()
+        return changed
+
+    def _apply_segment_op(self, op: Dict) -> bool:
+        """
+        Apply one upsert or delete, unless a newer operation on the same URL
+        was already applied. Returns True when the collection changed.
+        """
+        url = op["doc"]["url"] if op["op"] == "upsert" else op["url"]
+        if self._doc_seqs.get(url, 0) >= op["seq"]:
+            return False
+        self._doc_seqs[url] = op["seq"]
+
+        old_doc_id = self.doc_ids.pop(url, None)
+        if old_doc_id is not None:
+            self._mask_document(old_doc_id)
+        if op["op"] == "delete" or not self.owns_url(url):
+            self.reviews_index.pop(url, None)
+            return old_doc_id is not None
+
+        product = op["doc"]
+        doc_id = self.products.append(product)
+        self.doc_ids[url] = doc_id
+        self.doc_urls.append(url)
+        # Sorts after every base document, in the order segments are applied
+        self.global_doc_ids.append(self.base_doc_count + op["seq"])
+        self._add_doc_length(product)
+        self._add_exact_values(doc_id, product)
+
+        # Same fields and tokenizer as the indexer, for filtering and IDF
+        features = product.get("product_features", {})
+        title_terms, description_terms = self.analyzer.analyze_many(
+            (product.get("title", ""), product.get("description", "")))
+        title_tokens = set(title_terms)
+        description_tokens = set(description_terms)
+        self.delta_doc_freqs.update(title_tokens)
+        self.delta_doc_freqs.update(description_tokens)
+        field_tokens = title_tokens | description_tokens
+        field_tokens.update(self.analyzer.analyze(str(features.get("brand", ""))))
+        field_tokens.update(self.analyzer.analyze(str(features.get("made in", ""))))
+        for token in field_tokens:
+            self.delta_token_docs.setdefault(token, []).append(doc_id)
+        for field, terms in zip(POSITION_FIELDS, (title_terms, description_terms)):
+            for position, token in enumerate(terms):
+                self.delta_positions[field].setdefault(token, {}).setdefault(doc_id, []).append(position)
+
+        reviews = product.get("product_reviews", [])
+        if reviews:
+            self.reviews_index[url] = {
+                "total_reviews": len(reviews),
+                "mean_mark": sum(r.get("rating", 0) for r in reviews) / len(reviews),
+                "last_rating": reviews[-1].get("rating", 0)}
+        else:
+            self.reviews_index.pop(url, None)
+        return True
+
+    def _mask_document(self, doc_id: int) -> None:
+        """
+        Mark a replaced or deleted document in the deleted bitmap and take it
+        out of the document frequencies (counted like the title and
+        description indexes: once per distinct term of each field) and of
+        the positions of segment documents.
+        """
+        self.deleted |= 1 << doc_id
+        product = self.products[doc_id]
+        field_terms = self.analyzer.analyze_many((product.get("title", ""), product.get("description", "")))
+        for field, terms in zip(POSITION_FIELDS, field_terms):
+            terms = set(terms)
+            self.delta_doc_freqs.subtract(terms)
+            for term in terms:
+                term_positions = self.delta_positions[field].get(term)
+                if term_positions is not None and term_positions.pop(doc_id, None) is not None \
+                        and not term_positions:
+                    del self.delta_positions[field][term]
+        for token in [token for token, count in self.delta_doc_freqs.items() if count == 0]:
+            del self.delta_doc_freqs[token]
+
+    def doc_freq(self, token: str) -> int:
+        """
+        Document frequency of a token in this engine, counted per field
+        (title and description) like the indexes.
+        """
+        return self.title_index.doc_count(token) + \
+            self.description_index.doc_count(token) + self.delta_doc_freqs[token]
+
+    def idf(self, token: str) -> float:
+        """
+        Inverse document frequency of a token, cached after the first lookup.
+        """
+        idf = self._idf_cache.get(token)
+        if idf is None:
+            if self.collection_doc_freqs is not None and token in self.collection_doc_freqs:
+                doc_count = self.collection_doc_freqs[token]
+            else:
+                doc_count = self.doc_freq(token)
+            if doc_count <= 0:
+                idf = 0.0
+            else:
+                # A term of the title and the description of most documents
+                # can count more than the collection: keep the log defined
+                idf = math.log((max(self.collection_doc_count - doc_count, 0) + 0.5) / (doc_count + 0.5))
+            self._idf_cache[token] = idf
+        return idf
+
+    def term_upper_bound(self, token: str) -> float:
+        """
+        Highest contribution a single query token can add to a document score
+        (weighted BM25 plus title match), used to skip hopeless documents.
+        """
+        bound = self._term_bound_cache.get(token)
+        if bound is None:
+            idf = self.idf(token)
+            best = 0.0
+            for doc_id, tf in self.term_freqs(token).items():
+                length_norm = BM25_K1 * (1 - BM25_B + BM25_B * (self.doc_lengths[doc_id] / self.avg_doc_length))
+                best = max(best, idf * (tf * (BM25_K1 + 1) / (tf + length_norm)))
+            bound = best * 0.4 + 0.2
+            self._term_bound_cache[token] = bound
+        return bound
+
+    def compile_synonyms(self, synonyms: Dict[str, List[str]]) -> None:
+        """
+        Add a synonym dictionary ({term: [synonyms]}) to the expansion map.
+
+        Every term and synonym, as a tuple of query tokens so that multi-word
+        ones ("united states") match consecutive query tokens, maps to its
+        whole group. Members are stored as search terms: one-word ones as
+        their index term, multi-word ones as a phrase (see token_bitmap).
+        Several dictionaries (origins, colors...) can be added.
+        """
+        for term, term_synonyms in synonyms.items():
+            members = [(member, tuple(self.analyzer.analyze(member))) for member in (term, *term_synonyms)]
+            group = tuple(dict.fromkeys(terms[0] if len(terms) == 1 else " ".join(member.lower().split())
+                                        for member, terms in members if terms))
+            for _, key in members:
+                if not key:
+                    continue
+                previous = self.synonym_expansions.get(key, ())
+                self.synonym_expansions[key] = previous + tuple(m for m in group if m not in previous)
+                self.max_synonym_length = max(self.max_synonym_length, len(key))
+
+    def expand_query(self, query_tokens: List[str]) -> Dict[str, float]:
+        """
+        Expand query tokens with synonyms. Returns every term with its weight:
+        1 for query tokens, SYNONYM_WEIGHT for the terms added.
+        """
+        expanded = dict.fromkeys(query_tokens, 1.0)
+        for start in range(len(query_tokens)):
+            for length in range(1, min(self.max_synonym_length, len(query_tokens) - start) + 1):
+                for term in self.synonym_expansions.get(tuple(query_tokens[start:start + length]), ()):
+                    expanded.setdefault(term, SYNONYM_WEIGHT)
+        return expanded
+
+    def query_clauses(self, query_tokens: List[str]) -> List[Tuple[str, ...]]:
+        """
+        The query as the clauses an 'all' search requires: each query token
+        is a clause of its own, except the longest runs of tokens with
+        synonyms, which require one member of their group (OR clause).
+        """
+        clauses = []
+        start = 0
+        while start < len(query_tokens):
+            for length in range(min(self.max_synonym_length, len(query_tokens) - start), 0, -1):
+                group = self.synonym_expansions.get(tuple(query_tokens[start:start + length]))
+                if group:
+                    clauses.append(group)
+                    start += length
+                    break
+            else:
+                clauses.append((query_tokens[start],))
+                start += 1
+        return clauses
 
     def expand_query_with_country_synonyms(self, query_tokens: List[str]) -> List[str]:
         """
         Expand query tokens with origin synonyms.
         """
-        expanded_tokens = query_tokens.copy()
-        for country, synonyms in self.origin_synonyms.items():
-            if country in query_tokens:
-                expanded_tokens.extend(synonyms)
-            for synonym in synonyms:
-                if synonym in query_tokens:
-                    expanded_tokens.append(country)
-                    expanded_tokens.extend(
-                        [s for s in synonyms if s != synonym])
-        return list(set(expanded_tokens))
+        return list(self.expand_query(query_tokens))
 
-    def filter_documents_with_any_token(self, query_tokens: List[str]) -> Set[str]:
+    def token_bitmap(self, token: str) -> int:
         """
-        Filter documents that contain at least one query token.
+        Bitmap of the live documents whose title, description, brand or
+        origin contains the token, built on first use.
+
+        A token made of several words (multi-word synonym) is a phrase: it
+        matches the documents with its index terms in sequence in the title
+        or description, or with it as their brand or origin.
         """
-        matching_docs = set()
+        docs = self._token_bitmaps.get(token)
+        if docs is None:
+            if " " in token:
+                if self._facet_bitmaps is None:
+                    self._build_facet_bitmaps()
+                docs = bitmap.from_ids(self.phrase_match_documents(self.index_terms(token))) \
+                    | self._facet_bitmaps['brand'].get(token, 0) | self._facet_bitmaps['made_in'].get(token, 0)
+            else:
+                doc_ids = []
+                # Check all indexes for the token
+                for index in (self.title_index, self.description_index, self.brand_index, self.origin_index):
+                    doc_ids.extend(index.documents(token))
+                doc_ids.extend(self.delta_token_docs.get(token, ()))
+                docs = bitmap.from_ids(doc_ids)
+            docs &= ~self.deleted
+            self._token_bitmaps[token] = docs
+        return docs
 
+    def filter_documents_with_any_token(self, query_tokens: List[str],
+                                        allowed: Optional[int] = None) -> List[int]:
+        """
+        Filter documents that contain at least one query token, among the
+        allowed ones when a bitmap is given (see filter_bitmap).
+        Returns sorted document IDs.
+        """
+        matching_docs = 0
         for token in query_tokens:
-            # Check all indexes for the token
-            if token in self.title_index:
-                matching_docs.update(self.title_index[token].keys())
-            if token in self.description_index:
-                matching_docs.update(self.description_index[token].keys())
-            if token in self.brand_index:
-                matching_docs.update(self.brand_index[token])
-            if token in self.origin_index:
-                matching_docs.update(self.origin_index[token])
+            matching_docs |= self.token_bitmap(token)
+        if allowed is not None:
+            matching_docs &= allowed
+        return bitmap.to_ids(matching_docs)
 
-        return matching_docs
+    def filter_documents_with_all_tokens(self, query_tokens: List[str],
+                                         allowed: Optional[int] = None) -> List[int]:
+        """
+        Filter documents that contain all query tokens (except stopwords),
+        among the allowed ones when a bitmap is given (see filter_bitmap).
+        Returns sorted document IDs.
+        """
+        return self.filter_documents_with_all_clauses([(token,) for token in query_tokens], allowed)
 
-    def filter_documents_with_all_tokens(self, query_tokens: List[str]) -> Set[str]:
+    def filter_documents_with_all_clauses(self, clauses: List[Tuple[str, ...]],
+                                          allowed: Optional[int] = None) -> List[int]:
         """
-        Filter documents that contain all query tokens (except stopwords).
+        Filter documents that contain at least one token of every clause
+        (see query_clauses), among the allowed ones when a bitmap is given.
+        Returns sorted document IDs.
         """
-        if not query_tokens:
-            return set()
+        if not clauses:
+            return []
 
-        matching_docs = self.filter_documents_with_any_token([query_tokens[0]])
+        matching_docs = allowed
+        for clause in clauses:
+            if matching_docs == 0:
+                break
+            clause_docs = 0
+            for token in clause:
+                clause_docs |= self.token_bitmap(token)
+            matching_docs = clause_docs if matching_docs is None else matching_docs & clause_docs
 
-        for token in query_tokens[1:]:
-            token_docs = self.filter_documents_with_any_token([token])
-            matching_docs.intersection_update(token_docs)
+        return bitmap.to_ids(matching_docs)
 
-        return matching_docs
+    def normalize_filters(self, filters: Optional[Dict]) -> Tuple:
+        """
+        Hashable form of search filters: sorted (name, value) pairs, brand and
+        made_in as sorted tuples of lowercased values (made_in with its origin
+        synonyms), min_rating as a float and min_reviews as an int.
+        Filters set to None are ignored; unknown ones raise ValueError.
+        """
+        normalized = []
+        for name, value in (filters or {}).items():
+            if value is None:
+                continue
+            if name in ('brand', 'made_in'):
+                values = {str(v).lower().strip() for v in ([value] if isinstance(value, str) else value)}
+                if name == 'made_in':
+                    for v in list(values):
+                        values.update(synonym.lower() for synonym in
+                                      self.synonym_expansions.get(tuple(self.analyzer.analyze(v)), ()))
+                normalized.append((name, tuple(sorted(values))))
+            elif name == 'min_rating':
+                normalized.append((name, float(value)))
+            elif name == 'min_reviews':
+                normalized.append((name, int(value)))
+            else:
+                raise ValueError(f"unknown filter {name!r}, expected one of {', '.join(FILTER_NAMES)}")
+        return tuple(sorted(normalized))
 
-    def exact_match_search(self, query: str) -> Set[str]:
+    def _build_facet_bitmaps(self) -> None:
         """
-        Perform an exact match search.
+        Bitmaps of the live documents of every brand, origin and rating (mean
+        review mark rounded down), and the live reviewed documents sorted by
+        mean mark and by review count for the threshold filters.
         """
-        normalized_query = query.lower().strip()
-        matching_docs = set()
-
-        for doc_url, product in self.products.items():
-            # Title match
-            if normalized_query == product['title'].lower().strip():
-                matching_docs.add(doc_url)
-            # Brand match
-            if 'brand' in product and normalized_query == product['brand'].lower().strip():
-                matching_docs.add(doc_url)
-            # Origin match
-            if 'product_features' in product and 'made in' in product['product_features']:
-                if normalized_query == product['product_features']['made in'].lower().strip():
-                    matching_docs.add(doc_url)
+        facet_docs: Dict[str, Dict[str, List[int]]] = {facet: {} for facet in FACETS}
+        for facet, values in self.doc_facets.items():
+            for doc_id, value in enumerate(values):
+                if value is not None:
+                    facet_docs[facet].setdefault(value, []).append(doc_id)
 
-        return matching_docs
+        by_rating, by_reviews = [], []
+        for url, doc_id in self.doc_ids.items():
+            review_data = self.reviews_index.get(url)
+            if review_data and review_data['total_reviews']:
+                by_rating.append((review_data['mean_mark'], doc_id))
+                by_reviews.append((review_data['total_reviews'], doc_id))
+                facet_docs['rating'].setdefault(str(int(review_data['mean_mark'])), []).append(doc_id)
+        for name, pairs in (('min_rating', by_rating), ('min_reviews', by_reviews)):
+            pairs.sort()
+            self._review_arrays[name] = ([value for value, _ in pairs], [doc_id for _, doc_id in pairs])
+
+        live = ~self.deleted
+        self._facet_bitmaps = {
+            facet: {value: bitmap.from_ids(doc_ids) & live for value, doc_ids in values.items()}
+            for facet, values in facet_docs.items()}
+
+    def _threshold_bitmap(self, name: str, threshold: float) -> int:
+        """
+        Bitmap of the reviewed documents whose mean mark (min_rating) or
+        review count (min_reviews) is at least threshold.
+        """
+        key = (name, threshold)
+        if key not in self._threshold_bitmaps:
+            values, doc_ids = self._review_arrays[name]
+            self._threshold_bitmaps[key] = bitmap.from_ids(doc_ids[bisect.bisect_left(values, threshold):])
+        return self._threshold_bitmaps[key]
+
+    def filter_bitmap(self, filters: Tuple) -> Optional[int]:
+        """
+        Bitmap of the documents passing normalized filters (normalize_filters),
+        None when nothing is filtered. Values of brand and made_in are OR-ed,
+        filters are AND-ed; thresholds of 0 or less keep every document.
+        """
+        if self._facet_bitmaps is None:
+            self._build_facet_bitmaps()
+        allowed = None
+        for name, value in filters:
+            if name in ('brand', 'made_in'):
+                value_bitmaps = self._facet_bitmaps[name]
+                docs = 0
+                for v in value:
+                    docs |= value_bitmaps.get(v, 0)
+            elif value > 0:
+                docs = self._threshold_bitmap(name, value)
+            else:
+                continue
+            allowed = docs if allowed is None else allowed & docs
+        return allowed
 
-    def compute_bm25_score(self, doc_url: str, query_tokens: List[str], k1: float = 1.5, b: float = 0.75) -> float:
+    def facet_counts(self, doc_ids: List[int]) -> Dict[str, Dict[str, int]]:
         """
-        Calculate BM25 score for a document.
+        Number of documents of each brand, origin and rating among doc_ids,
+        most frequent values first.
+        """
+        if self._facet_bitmaps is None:
+            self._build_facet_bitmaps()
+        docs = bitmap.from_ids(doc_ids)
+        counts = {}
+        for facet, value_bitmaps in self._facet_bitmaps.items():
+            value_counts = ((value, bitmap.count(docs & value_docs)) for value, value_docs in value_bitmaps.items())
+            counts[facet] = dict(sorted((item for item in value_counts if item[1]),
+                                        key=lambda item: (-item[1], item[0])))
+        return counts
+
+    def term_positions(self, field: str, term: str) -> Dict[int, List[int]]:
+        """
+        Sorted positions of an index term in a field ('title' or
+        'description') of every live document, built on first use.
+        """
+        key = (field, term)
+        positions = self._term_positions.get(key)
+        if positions is None:
+            index = self.title_index if field == 'title' else self.description_index
+            positions = {}
+            for doc_id, doc_positions in index.postings(term):
+                if not bitmap.contains(self.deleted, doc_id):
+                    positions[doc_id] = doc_positions
+            for doc_id, doc_positions in self.delta_positions[field].get(term, {}).items():
+                if not bitmap.contains(self.deleted, doc_id):
+                    positions[doc_id] = doc_positions
+            self._term_positions[key] = positions
+        return positions
+
+    def term_freqs(self, term: str) -> Dict[int, int]:
+        """
+        Frequency of an index term in the title and description of every
+        live document (its number of positions), built on first use.
+        """
+        freqs = self._term_freqs.get(term)
+        if freqs is None:
+            title_positions, description_positions = (
+                self.term_positions(field, term) for field in POSITION_FIELDS)
+            freqs = {doc_id: len(positions) for doc_id, positions in title_positions.items()}
+            for doc_id, positions in description_positions.items():
+                freqs[doc_id] = freqs.get(doc_id, 0) + len(positions)
+            self._term_freqs[term] = freqs
+        return freqs
+
+    def query_postings(self, tokens: Iterable[str]) -> Dict[str, Tuple[Dict[int, int], Dict[int, List[int]]]]:
+        """
+        Term frequencies and title positions of each token, looked up once
+        per query instead of once per scored document.
+        """
+        return {token: (self.term_freqs(token), self.term_positions('title', token)) for token in tokens}
+
+    def index_terms(self, text: str) -> List[str]:
+        """
+        Query text as index terms (no punctuation, no stopwords), in order.
+        """
+        return self.analyzer.analyze(text)
+
+    def parse_phrases(self, query: str) -> List[List[str]]:
+        """
+        Index terms of each quoted phrase of the query.
+        """
+        return [terms for terms in map(self.index_terms, PHRASE_PATTERN.findall(query)) if terms]
+
+    def _field_positions(self, terms: List[str]) -> List[List[Dict[int, List[int]]]]:
+        """
+        term_positions of each term, for each of the POSITION_FIELDS.
+        """
+        return [[self.term_positions(field, term) for term in terms] for field in POSITION_FIELDS]
+
+    @staticmethod
+    def _in_sequence(doc_id: int, field_positions: List[List[Dict[int, List[int]]]], window: int) -> bool:
+        """
+        Whether the terms of field_positions (_field_positions) appear in this
+        order in one field of the document, each at most window positions
+        after the previous one.
+        """
+        for positions in field_positions:
+            reachable = positions[0].get(doc_id)
+            for term_positions in positions[1:]:
+                if not reachable:
+                    break
+                reachable = follow_positions(reachable, term_positions.get(doc_id, []), window)
+            if reachable:
+                return True
+        return False
+
+    def _terms_in_sequence(self, doc_id: int, terms: List[str], window: int) -> bool:
+        """
+        Whether the terms appear in this order in one field of the document,
+        each at most window positions after the previous one.
+        """
+        return self._in_sequence(doc_id, self._field_positions(terms), window)
+
+    def phrase_match_documents(self, terms: List[str], window: int = 1) -> List[int]:
+        """
+        Documents containing a phrase (window=1) or its terms in order with
+        at most window - 1 other terms between two of them. Returns sorted
+        document IDs.
+        """
+        field_positions = self._field_positions(terms)
+        candidates = set()
+        for positions in field_positions:
+            # Start from the rarest term: only its documents can match
+            postings = sorted(positions, key=len)
+            candidates.update(doc_id for doc_id in postings[0]
+                              if all(doc_id in other for other in postings[1:]))
+        return sorted(doc_id for doc_id in candidates if self._in_sequence(doc_id, field_positions, window))
+
+    def compute_proximity_score(self, doc_id: int, proximity_terms: List[str]) -> float:
+        """
+        Share of consecutive query term pairs found close together
+        (PROXIMITY_WINDOW), times PROXIMITY_BONUS.
+        """
+        pairs = list(zip(proximity_terms, proximity_terms[1:]))
+        if not pairs:
+            return 0
+        close_pairs = sum(1 for pair in pairs if self._terms_in_sequence(doc_id, pair, PROXIMITY_WINDOW))
+        return PROXIMITY_BONUS * close_pairs / len(pairs)
+
+    def exact_match_docs(self, normalized_query: str) -> Set[int]:
+        """
+        Documents whose title, brand or origin equals the normalized query
+        (deleted documents included).
+        """
+        return {doc_id
+                for values in (self.exact_titles, self.exact_brands, self.exact_origins)
+                for doc_id in values.get(normalized_query, ())}
+
+    def exact_match_search(self, query: str) -> List[int]:
+        """
+        Perform an exact match search.
+        """
+        return sorted(doc_id for doc_id in self.exact_match_docs(query.lower().strip())
+                      if not bitmap.contains(self.deleted, doc_id))
+
+    def compute_bm25_score(self, doc_id: int, query_tokens: List[str], k1: float = BM25_K1, b: float = BM25_B,
+                           token_weights: Optional[Dict[str, float]] = None,
+                           postings: Optional[Dict[str, Tuple]] = None) -> float:
+        """
+        Calculate BM25 score for a document, each term scaled by its weight
+        in token_weights (default 1). postings are the query_postings of the
+        query tokens, when the caller scores several documents.
         """
         score = 0
-        doc = self.products[doc_url]
-        doc_text = f"{doc['title']} {doc['description']}"
-        doc_tokens = self.tokenize_text(doc_text)
+        if postings is None:
+            postings = self.query_postings(query_tokens)
 
         # Document length normalization
-        avg_doc_length = 300  # Approximate average document length
-        doc_length = len(doc_tokens)
+        length_norm = k1 * (1 - b + b * (self.doc_lengths[doc_id] / self.avg_doc_length))
 
         for token in query_tokens:
-            # Calculate term frequency in document
-            tf = doc_tokens.count(token)
-
-            # Calculate inverse document frequency
-            doc_count = len(self.title_index.get(token, {})) + \
-                len(self.description_index.get(token, {}))
-            if doc_count == 0:
+            tf = postings[token][0].get(doc_id, 0)
+            if tf == 0:
                 continue
 
-            idf = math.log(
-                (len(self.products) - doc_count + 0.5) / (doc_count + 0.5))
+            idf = self.idf(token)
+            if idf == 0:
+                continue
 
             # Calculate BM25 score for this term
-            numerator = tf * (k1 + 1)
-            denominator = tf + k1 * (1 - b + b * (doc_length / avg_doc_length))
-            score += idf * (numerator / denominator)
+            weight = token_weights.get(token, 1.0) if token_weights else 1.0
+            score += weight * idf * (tf * (k1 + 1) / (tf + length_norm))
 
         return score
 
-    def compute_ranking_score(self, doc_url: str, query: str, query_tokens: List[str]) -> Dict[str, float]:
+    def compute_review_score(self, doc_id: int) -> float:
         """
-        Calculate final ranking score combining multiple signals
-        Returns both final score and individual component scores for transparency.
-        
+        Review component of the ranking score (30% weight).
         """
-        doc = self.products[doc_url]
-        scores = {
-            'bm25_score': 0,
-            'exact_match_score': 0,
-            'review_score': 0,
-            'title_match_score': 0,
-            'origin_match_score': 0
-        }
+        review_data = self.reviews_index.get(self.doc_urls[doc_id])
+        if review_data is None:
+            return 0
+        base_review_score = (review_data['mean_mark'] * 0.3 +
+                             min(review_data['total_reviews'], 10) * 0.1)
+        return base_review_score * 0.3
+
+    def _score_components(self, doc_id: int, exact_docs: Set[int], query_tokens: List[str],
+                          token_weights: Optional[Dict[str, float]] = None,
+                          proximity_terms: Tuple[str, ...] = (),
+                          postings: Optional[Dict[str, Tuple]] = None) -> Tuple[float, ...]:
+        """
+        Compute the ranking components of a document, in SCORE_COMPONENTS order.
+        exact_docs are the documents matching the query exactly (exact_match_docs),
+        proximity_terms the query as index terms (index_terms) and postings
+        the query_postings of the query tokens.
+        """
+        if postings is None:
+            postings = self.query_postings(query_tokens)
 
         # 1. BM25 score (40% weight)
-        scores['bm25_score'] = self.compute_bm25_score(doc_url, query_tokens) * 0.4
+        bm25_score = self.compute_bm25_score(doc_id, query_tokens, token_weights=token_weights,
+                                             postings=postings) * 0.4
 
         # 2. Exact match bonus (fixed score of 2.0)
-        if (query.lower().strip() == doc['title'].lower().strip() or
-            ('brand' in doc and query.lower().strip() == doc['brand'].lower().strip()) or
-            ('product_features' in doc and 'made in' in doc['product_features'] and
-             query.lower().strip() == doc['product_features']['made in'].lower().strip())):
-            scores['exact_match_score'] = 2.0
+        exact_match_score = EXACT_MATCH_BONUS if doc_id in exact_docs else 0
 
         # 3. Review score (30% weight)
-        if doc_url in self.reviews_index:
-            review_data = self.reviews_index[doc_url]
-            base_review_score = (review_data['mean_mark'] * 0.3 +
-                                 min(review_data['total_reviews'], 10) * 0.1)
-            scores['review_score'] = base_review_score * 0.3
+        review_score = self.static_scores[doc_id]
 
         # 4. Title match score (20% weight)
-        title_tokens = self.tokenize_text(doc['title'])
         title_matches = sum(
-            1 for token in query_tokens if token in title_tokens)
-        scores['title_match_score'] = title_matches * 0.2
+            (token_weights.get(token, 1.0) if token_weights else 1.0)
+            for token in query_tokens if doc_id in postings[token][1])
+        title_match_score = title_matches * 0.2
 
         # 5. Origin match score (10% weight)
-        if 'product_features' in doc and 'made in' in doc['product_features']:
-            origin = doc['product_features']['made in'].lower()
-            if origin in query_tokens:
-                scores['origin_match_score'] = 0.1
+        origin_match_score = 0
+        origin = self.doc_origins[doc_id]
+        if origin is not None and origin in query_tokens:
+            origin_match_score = ORIGIN_MATCH_BONUS
+
+        # 6. Proximity score
+        proximity_score = self.compute_proximity_score(doc_id, proximity_terms)
+
+        return (bm25_score, exact_match_score, review_score,
+                title_match_score, origin_match_score, proximity_score)
+
+    def compute_ranking_score(self, doc_id: int, query: str, query_tokens: List[str],
+                              token_weights: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        """
+        Calculate final ranking score combining multiple signals
+        Returns both final score and individual component scores for transparency.
+        
+        """
+        components = self._score_components(
+            doc_id, self.exact_match_docs(query.lower().strip()), query_tokens, token_weights,
+            self.index_terms(query))
+        scores = dict(zip(SCORE_COMPONENTS, components))
 
         # Calculate final score
-        scores['final_score'] = sum(scores.values())
+        scores['final_score'] = sum(components)
         return scores
 
+    def rank_documents(self, matching_docs: List[int], query: str, query_tokens: List[str],
+                       k: Optional[int] = None,
+                       token_weights: Optional[Dict[str, float]] = None) -> List[Tuple[float, int]]:
+        """
+        Score the matching documents and return (final_score, doc_id) pairs, best first.
+
+        When k is given only a heap of the k best documents is kept. Documents
+        are visited by decreasing review score (the only query independent
+        component) and skipped, MaxScore style, as soon as their upper bound
+        cannot beat the current k-th score.
+
+        From VECTORIZED_MIN_CANDIDATES matching documents, and when NumPy is
+        installed, every document is scored at once by rank_documents_vectorized.
+        """
+        if np is not None and len(matching_docs) >= VECTORIZED_MIN_CANDIDATES:
+            return self.rank_documents_vectorized(matching_docs, query, query_tokens, k, token_weights)
+
+        exact_docs = self.exact_match_docs(query.lower().strip())
+        proximity_terms = self.index_terms(query)
+        postings = self.query_postings(set(query_tokens).union(proximity_terms))
+
+        if k is None or k >= len(matching_docs):
+            ranked = [(sum(self._score_components(doc_id, exact_docs, query_tokens, token_weights, proximity_terms,
+                                                  postings)), doc_id)
+                      for doc_id in matching_docs]
+            ranked.sort(key=lambda x: (-x[0], x[1]))
+            return ranked[:k] if k is not None else ranked
+        if k <= 0:
+            return []
+
+        term_bounds = {token: self.term_upper_bound(token) * (token_weights.get(token, 1.0) if token_weights else 1.0)
+                       for token in set(query_tokens)}
+        max_terms_bound = sum(bound for bound in term_bounds.values() if bound > 0)
+        # Bonuses are bounded per document: the origin bonus only for documents
+        # whose origin is a query token, proximity by the pairs a document holds
+        query_token_set = set(query_tokens)
+        origin_bound = ORIGIN_MATCH_BONUS if not query_token_set.isdisjoint(self.origin_values) else 0.0
+        pairs = list(zip(proximity_terms, proximity_terms[1:]))
+        proximity_bound = PROXIMITY_BONUS if pairs else 0.0
+
+        # Only exact matches get the exact bonus: they are visited first, so
+        # that the bound of the other documents leaves it out
+        ordered = sorted(matching_docs, key=self.static_rank.__getitem__)
+        groups = (([doc_id for doc_id in ordered if doc_id in exact_docs], EXACT_MATCH_BONUS),
+                  ([doc_id for doc_id in ordered if doc_id not in exact_docs] if exact_docs else ordered, 0.0))
+
+        heap: List[Tuple[float, int]] = []  # (score, -doc_id)
+        for group, exact_bound in groups:
+            bonus_bound = exact_bound + origin_bound + proximity_bound
+            for doc_id in group:
+                static_score = self.static_scores[doc_id]
+                if len(heap) == k:
+                    threshold = heap[0][0]
+                    # Every remaining document of the group has a lower static score
+                    if static_score + bonus_bound + max_terms_bound < threshold:
+                        break
+                    doc_bound = static_score + exact_bound + sum(
+                        bound for token, bound in term_bounds.items()
+                        if bound > 0 and doc_id in postings[token][0])
+                    if origin_bound and self.doc_origins[doc_id] in query_token_set:
+                        doc_bound += origin_bound
+                    if proximity_bound:
+                        doc_bound += proximity_bound * sum(
+                            1 for first, second in pairs
+                            if doc_id in postings[first][0] and doc_id in postings[second][0]) / len(pairs)
+                    if doc_bound < threshold:
+                        continue
+
+                # Ties go to the lowest doc ID, as in the full ranking
+                entry = (sum(self._score_components(doc_id, exact_docs, query_tokens, token_weights, proximity_terms,
+                                                    postings)), -doc_id)
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+        return sorted(((score, -neg_doc_id) for score, neg_doc_id in heap), key=lambda x: (-x[0], x[1]))
+
+    def _build_feature_arrays(self) -> None:
+        """
+        Hold the query independent features of every document (review score,
+        length, origin ID) as NumPy arrays, built on first vectorized ranking.
+        """
+        self._static_array = np.array(self.static_scores, dtype=np.float64)
+        self._length_array = np.array(self.doc_lengths, dtype=np.float64)
+        self._origin_ids: Dict[str, int] = {}
+        origins = []
+        for origin in self.doc_origins:
+            if origin is None:
+                origins.append(-1)
+            else:
+                origins.append(self._origin_ids.setdefault(origin, len(self._origin_ids)))
+        self._origin_array = np.array(origins, dtype=np.int64)
+
+    def term_arrays(self, token: str) -> Tuple:
+        """
+        Postings of a token as NumPy arrays: the doc IDs containing it with
+        their term frequencies, and the doc IDs with it in their title.
+        """
+        arrays = self._term_arrays.get(token)
+        if arrays is None:
+            freqs = self.term_freqs(token)
+            title_positions = self.term_positions('title', token)
+            arrays = (
+                np.fromiter(freqs.keys(), dtype=np.int64, count=len(freqs)),
+                np.fromiter(freqs.values(), dtype=np.float64, count=len(freqs)),
+                np.fromiter(title_positions.keys(), dtype=np.int64, count=len(title_positions)))
+            self._term_arrays[token] = arrays
+        return arrays
+
+    def proximity_counts(self, candidates, proximity_terms: List[str]):
+        """
+        Number of consecutive query term pairs found close together
+        (PROXIMITY_WINDOW) in each document, for the candidate documents
+        (a boolean array by doc ID) only.
+        """
+        counts = np.zeros(len(self.products), dtype=np.float64)
+        for pair in zip(proximity_terms, proximity_terms[1:]):
+            field_positions = self._field_positions(pair)
+            both = set()
+            for first, second in field_positions:
+                both.update(doc_id for doc_id in first if doc_id in second)
+            for doc_id in both:
+                if candidates[doc_id] and self._in_sequence(doc_id, field_positions, PROXIMITY_WINDOW):
+                    counts[doc_id] += 1
+        return counts
+
+    def rank_documents_vectorized(self, matching_docs: List[int], query: str, query_tokens: List[str],
+                                  k: Optional[int] = None,
+                                  token_weights: Optional[Dict[str, float]] = None) -> List[Tuple[float, int]]:
+        """
+        Same ranking as rank_documents, computed with NumPy: each component is
+        accumulated for every document term by term from the postings, then
+        the k best candidates are selected with argpartition.
+        """
+        if not matching_docs or (k is not None and k <= 0):
+            return []
+        if self._static_array is None:
+            self._build_feature_arrays()
+        if self._length_norms is None:
+            self._length_norms = BM25_K1 * (1 - BM25_B + BM25_B * (self._length_array / self.avg_doc_length))
+
+        doc_count = len(self.products)
+        bm25 = np.zeros(doc_count, dtype=np.float64)
+        title_matches = np.zeros(doc_count, dtype=np.float64)
+        for token in query_tokens:
+            weight = token_weights.get(token, 1.0) if token_weights else 1.0
+            doc_ids, tfs, title_doc_ids = self.term_arrays(token)
+            title_matches[title_doc_ids] += weight
+            idf = self.idf(token)
+            if idf != 0 and len(doc_ids):
+                bm25[doc_ids] += weight * idf * (tfs * (BM25_K1 + 1) / (tfs + self._length_norms[doc_ids]))
+
+        candidates = np.asarray(matching_docs, dtype=np.int64)
+        exact = np.zeros(doc_count, dtype=np.float64)
+        exact[list(self.exact_match_docs(query.lower().strip()))] = EXACT_MATCH_BONUS
+        query_origins = [self._origin_ids[token] for token in query_tokens if token in self._origin_ids]
+        origin = np.where(np.isin(self._origin_array, query_origins), ORIGIN_MATCH_BONUS, 0.0)
+
+        # Summed in SCORE_COMPONENTS order, so scores equal the per document ones
+        scores = bm25[candidates] * 0.4 + exact[candidates] + self._static_array[candidates] \
+            + title_matches[candidates] * 0.2 + origin[candidates]
+        proximity_terms = self.index_terms(query)
+        if len(proximity_terms) > 1:
+            is_candidate = np.zeros(doc_count, dtype=bool)
+            is_candidate[candidates] = True
+            close_pairs = self.proximity_counts(is_candidate, proximity_terms)
+            scores = scores + PROXIMITY_BONUS * close_pairs[candidates] / (len(proximity_terms) - 1)
+
+        if k is not None and k < len(candidates):
+            # Keep every candidate tied with the k-th score: ties go to the lowest doc ID
+            best = np.argpartition(-scores, k - 1)[:k]
+            keep = scores >= scores[best].min()
+            candidates, scores = candidates[keep], scores[keep]
+        order = np.lexsort((candidates, -scores))[:k]
+        return [(float(scores[i]), int(candidates[i])) for i in order]
+
     def _save_search_results(self, results: Dict) -> None:
         """
-        Save search results to a JSON file.
+        Queue search results for the result log (compressed JSONL segments in
+        results_dir, see result_log.py). Returns without waiting for the disk.
+        """
+        if self.result_log is None:
+            self.result_log = ResultLog(self.results_dir)
+        self.result_log.put(results)
+
+    def close(self) -> None:
+        """
+        Write the queued results and close the product file.
+        """
+        if self.result_log is not None:
+            self.result_log.close()
+        self.products.close()
+
+    def analyze_query(self, query: str, trace: Optional[QueryTrace] = None) -> Dict[str, float]:
+        """
+        Tokenize a query, drop stopwords and expand it with synonyms.
+        Returns the terms and their weights (see expand_query).
         """
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        query_slug = re.sub(r'[^a-z0-9]+', '_',
-                            results['metadata']['query'].lower())
-        filename = f"search_{query_slug}_{timestamp}.json"
-        filepath = os.path.join(self.results_dir, filename)
+        trace = trace or QueryTrace()
+        with trace.stage('tokenize'):
+            query_tokens = self.analyzer.analyze(query)
+        with trace.stage('expand'):
+            token_weights = self.expand_query(query_tokens)
+        trace.count('query_terms', len(query_tokens))
+        trace.count('expanded_terms', len(token_weights))
+        return token_weights
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+    def filter_documents_with_phrases(self, phrases: List[List[str]], window: int = 1) -> List[int]:
+        """
+        Documents matching every phrase (see phrase_match_documents).
+        Returns sorted document IDs.
+        """
+        matching_docs = self.phrase_match_documents(phrases[0], window)
+        for terms in phrases[1:]:
+            if not matching_docs:
+                break
+            phrase_docs = set(self.phrase_match_documents(terms, window))
+            matching_docs = [doc_id for doc_id in matching_docs if doc_id in phrase_docs]
+        return matching_docs
 
-    def search(self, query: str, search_type: str = 'any', save_results: bool = False) -> Dict:
+    def _run_query(self, query: str, search_type: str, k: Optional[int],
+                   token_weights: Optional[Dict[str, float]] = None,
+                   phrase_window: int = 1,
+                   trace: Optional[QueryTrace] = None,
+                   filters: Tuple = ()) -> Tuple[List[int], List[Tuple[int, Dict]]]:
+        """
+        Filter and rank the documents of a query. Returns the matching doc IDs
+        and the (doc_id, result) pairs of the ranked ones, best first.
+        Only documents passing the normalized filters (normalize_filters) are
+        candidates. Stages are timed in trace when one is given.
+        """
+        trace = trace or QueryTrace()
+        if token_weights is None:
+            token_weights = self.analyze_query(query, trace)
+        expanded_tokens = list(token_weights)
+
+        # Get matching documents based on search type
+        with trace.stage('filter'):
+            # Structured filters narrow the candidates before any scoring
+            allowed = self.filter_bitmap(filters) if filters else None
+            phrases = self.parse_phrases(query)
+            if search_type == 'exact':
+                matching_docs = self.exact_match_search(query)
+            elif phrases:
+                # Quoted phrases are required: their documents are the candidates
+                matching_docs = self.filter_documents_with_phrases(phrases, phrase_window)
+                if search_type == 'all' and matching_docs:
+                    all_docs = set(self.filter_documents_with_all_clauses(
+                        self.query_clauses(self.analyzer.analyze(query)), allowed))
+                    matching_docs = [doc_id for doc_id in matching_docs if doc_id in all_docs]
+            elif search_type == 'all':
+                # Synonyms of a query token are alternatives, not extra requirements
+                matching_docs = self.filter_documents_with_all_clauses(
+                    self.query_clauses(self.analyzer.analyze(query)), allowed)
+            else:  # 'any'
+                matching_docs = self.filter_documents_with_any_token(expanded_tokens, allowed)
+            if allowed is not None and (search_type == 'exact' or phrases):
+                matching_docs = [doc_id for doc_id in matching_docs if bitmap.contains(allowed, doc_id)]
+        trace.count('candidates', len(matching_docs))
+
+        # Rank documents, keeping the detailed scores for the returned ones only
+        with trace.stage('rank'):
+            top = self.rank_documents(matching_docs, query, expanded_tokens, k, token_weights)
+        ranked = []
+        with trace.stage('render'):
+            for _, doc_id in top:
+                scores = self.compute_ranking_score(
+                    doc_id, query, expanded_tokens, token_weights)
+                doc = self.products[doc_id]
+                ranked.append((doc_id, {
+                    'title': doc['title'],
+                    'url': self.doc_urls[doc_id],
+                    'description': doc['description'],
+                    'scores': scores,
+                    'score': round(scores['final_score'], 3)
+                }))
+        trace.count('returned', len(ranked))
+        return matching_docs, ranked
+
+    def search_shard(self, query: str, search_type: str, k: Optional[int], stats: Dict,
+                     phrase_window: int = 1, filters: Tuple = (), facets: bool = False) -> Dict:
+        """
+        Search this shard with the global statistics of the collection.
+        Results carry the global doc ID that the coordinator breaks ties with;
+        facet counts, when asked for, are those of this shard's documents.
+        """
+        self.use_collection_statistics(stats)
+        matching_docs, ranked = self._run_query(query, search_type, k, phrase_window=phrase_window,
+                                                filters=filters)
+        return {
+            'filtered_documents': len(matching_docs),
+            'facets': self.facet_counts(matching_docs) if facets else None,
+            'index_version': self.index_version,
+            'results': [(result['scores']['final_score'], self.global_doc_ids[doc_id], result)
+                        for doc_id, result in ranked]
+        }
+
+    def search(self, query: str, search_type: str = 'any', save_results: bool = False,
+               k: Optional[int] = None, phrase_window: int = 1, profile: bool = False,
+               filters: Optional[Dict] = None, facets: bool = False) -> Dict:
         """
         Main search function with different search types and optional result saving.
 
         Parameters:
-        - query: Search query string.
+        - query: Search query string. Quoted parts ("box of chocolate") are
+          phrases every result must contain, for 'any' and 'all' searches.
         - search_type: Type of search ('any', 'all', or 'exact').
         - save_results: Whether to save results to a JSON file (default: False).
+        - k: Number of results to return (default: None, every matching document).
+        - phrase_window: Largest distance between consecutive terms of a phrase
+          (default: 1, the terms must be adjacent).
+        - profile: Run the query under cProfile and add the functions that
+          took the most time to the metadata, as text (default: False).
+        - filters: Structured filters, applied before any document is scored:
+          {'brand': [...], 'made_in': [...]} keep the documents of one of the
+          brands / origins (case insensitive, origin synonyms included),
+          {'min_rating': 4.0, 'min_reviews': 3} the reviewed documents with at
+          least this mean mark / review count (default: None).
+        - facets: Add to the results the number of matching documents of
+          each brand, origin and rating (results['facets']) (default: False).
+
+        Results are cached by analyzed query; cached result dicts are shared
+        between calls and must not be modified.
+
+        The metadata holds the duration of each stage (timings_ms) and the
+        number of terms and documents each one handled (counts); every query
+        is also added up in self.metrics.
         """
-        # Tokenize and normalize query
-        query_tokens = self.tokenize_text(query)
-        query_tokens = [
-            token for token in query_tokens if token not in STOPWORDS]
-        expanded_tokens = self.expand_query_with_country_synonyms(query_tokens)
+        return self._traced_search(query, search_type, save_results, k, phrase_window, profile,
+                                   filters=self.normalize_filters(filters), facets=facets)
 
-        # Get matching documents based on search type
-        if search_type == 'exact':
-            matching_docs = self.exact_match_search(query)
-        elif search_type == 'all':
-            matching_docs = self.filter_documents_with_all_tokens(expanded_tokens)
-        else:  # 'any'
-            matching_docs = self.filter_documents_with_any_token(expanded_tokens)
-
-        # Rank documents with detailed scores
-        ranked_docs = []
-        for doc_url in matching_docs:
-            scores = self.compute_ranking_score(
-                doc_url, query, expanded_tokens)
-            doc = self.products[doc_url]
-            ranked_docs.append({
-                'title': doc['title'],
-                'url': doc_url,
-                'description': doc['description'],
-                'scores': scores,
-                'score': round(scores['final_score'], 3)
-            })
-
-        # Sort by final score
-        ranked_docs.sort(key=lambda x: x['score'], reverse=True)
+    def _traced_search(self, query: str, search_type: str, save_results: bool, k: Optional[int],
+                       phrase_window: int, profile: bool = False,
+                       token_weights: Optional[Dict[str, float]] = None,
+                       filters: Tuple = (), facets: bool = False, refresh: bool = True) -> Dict:
+        """
+        search, with the query already analyzed when token_weights is given
+        and the filters normalized (normalize_filters). With refresh=False
+        segments are not checked (search_many did it for the whole batch).
+        """
+        trace = QueryTrace()
+        profile_output: Dict[str, str] = {}
+        if profile:
+            profiler = profile_block(profile_output)
+        elif self.profile_hook is not None:
+            profiler = self.profile_hook(query, search_type)
+        else:
+            profiler = nullcontext()
+
+        with profiler:
+            results = self._search(query, search_type, k, phrase_window, trace, token_weights, filters, facets,
+                                   refresh)
+        results['metadata'].update(profile_output)
+
+        # Save results if requested: the logged record has the timings up to
+        # the save, the returned one also the time spent saving
+        if save_results:
+            results['metadata'].update(trace.metadata())
+            with trace.stage('save'):
+                self._save_search_results(results)
+        results['metadata'].update(trace.metadata())
+
+        self.metrics.record(search_type, trace, results['metadata']['cached'])
+        return results
+
+    def _search(self, query: str, search_type: str, k: Optional[int],
+                phrase_window: int, trace: QueryTrace,
+                token_weights: Optional[Dict[str, float]] = None,
+                filters: Tuple = (), facets: bool = False, refresh: bool = True) -> Dict:
+        """
+        Body of search, with its stages timed in trace.
+        """
+        # Pick up documents updated since the last query
+        if refresh:
+            with trace.stage('refresh'):
+                self.refresh()
+
+        # The normalized query is part of the key: exact matching compares it as a whole
+        if token_weights is None:
+            token_weights = self.analyze_query(query, trace)
+        with trace.stage('cache'):
+            cache_key = (search_type, k, phrase_window, query.lower().strip(), tuple(sorted(token_weights.items())),
+                         filters, facets)
+            cached = self.result_cache.get(cache_key, self.index_version)
+        if cached is None:
+            matching_docs, ranked = self._run_query(query, search_type, k, token_weights, phrase_window, trace,
+                                                    filters)
+            filtered_count = len(matching_docs)
+            ranked_docs = [result for _, result in ranked]
+            facet_counts = None
+            if facets:
+                with trace.stage('facets'):
+                    facet_counts = self.facet_counts(matching_docs)
+            self.result_cache.put(cache_key, self.index_version, (filtered_count, ranked_docs, facet_counts))
+        else:
+            filtered_count, ranked_docs, facet_counts = cached
 
         # Prepare results
         results = {
@@ -283,17 +1411,59 @@ class SearchEngine:
                 'query': query,
                 'search_type': search_type,
                 'timestamp': datetime.now().isoformat(),
-                'total_documents': len(self.products),
-                'filtered_documents': len(matching_docs)
+                'total_documents': len(self.doc_ids),
+                'filtered_documents': filtered_count,
+                'k': k,
+                'index_version': self.index_version,
+                'cached': cached is not None
             },
-            'results': ranked_docs
+            'results': list(ranked_docs)
         }
+        if filters:
+            results['metadata']['filters'] = {name: list(value) if isinstance(value, tuple) else value
+                                              for name, value in filters}
+        if facets:
+            results['facets'] = facet_counts
+        return results
+
+    def search_many(self, queries: Iterable[str], search_types: Iterable[str] = ('any',),
+                    k: Optional[int] = None, save_results: bool = False, phrase_window: int = 1,
+                    filters: Optional[Dict] = None, facets: bool = False) -> List[Dict[str, Dict]]:
+        """
+        Search every query with every search type. Returns, for each query in
+        order, its results by search type (as search returns them); a query
+        repeated in the batch runs once and shares its result dicts. filters
+        and facets apply to every query (see search).
+
+        Segments are checked once, before the first query, so that the whole
+        batch sees one index version, and each distinct query is analyzed
+        once for all search types. The postings, bitmaps and IDF of a term
+        are built once by whichever query needs them first and kept in the
+        engine's term caches (term_cache_size), as for separate searches.
+
+        Queries are not scored together: each one is filtered and ranked on
+        its own, one after the other, in this process. A pool does not help:
+        forked workers were slower than one process, since they pay for their
+        own start and for sending the results back.
+        """
+        queries = list(queries)
+        search_types = list(search_types)
+        filters = self.normalize_filters(filters)
+        self.refresh(force=True)
+
+        analyzed = {query: self.analyze_query(query) for query in dict.fromkeys(queries)}
+        by_query = {query: {search_type: self._traced_search(query, search_type, False, k, phrase_window,
+                                                             token_weights=token_weights,
+                                                             filters=filters, facets=facets, refresh=False)
+                            for search_type in search_types}
+                    for query, token_weights in analyzed.items()}
 
-        # Save results if requested
         if save_results:
-            self._save_search_results(results)
+            for results in by_query.values():
+                for search_type_results in results.values():
+                    self._save_search_results(search_type_results)
+        return [by_query[query] for query in queries]
 
-        return results
 
 if __name__ == "__main__":
     # Initialize search engine
@@ -310,12 +1480,12 @@ if __name__ == "__main__":
     # Test each query with all search types
     search_types = ['all', 'exact', 'any',]
 
-    for query in test_queries:
+    batch = search_engine.search_many(test_queries, search_types, k=10, save_results=True)
+    for query, query_results in zip(test_queries, batch):
         print(f"\nTesting query: {query}")
         for search_type in search_types:
             print(f"\nSearch type: {search_type}")
-            results = search_engine.search(
-                query, search_type, save_results=True)
+            results = query_results[search_type]
             print(
                 f"Found {results['metadata']['filtered_documents']} documents")
             for i, doc in enumerate(results['results'][:3], 1):
@@ -0,0 +1,164 @@
+# **************************************************************************** #
+#                                                                              #
+#                                                         :::      ::::::::    #
+#    tracing.py                                         :+:      :+:    :+:    #
+#                                                     +:+ +:+         +:+      #
+#    By: ccottet <ccottet@student.42.fr>            +#+  +:+       +#+         #
+#                                                 +#+#+#+#+#+   +#+            #
+#    Created: 2026/10/17 20:31:52 by ccottet           #+#    #+#              #
+#    Updated: 2026/10/17 20:31:52 by ccottet          ###   ########.fr        #
+#                                                                              #
+# **************************************************************************** #
+
+
+"""
+Timing of the stages of a search.
+
+A QueryTrace records how long each stage of one query took and how many
+documents it handled; SearchEngine.search attaches it to the result metadata.
+SearchMetrics adds the traces of every query up, and exports them as JSON or
+in the Prometheus text format.
+"""
+
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+# Upper bounds (seconds) of the query latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Functions listed in a query profile
+PROFILE_LINES = 25
+
+
+class QueryTrace:
+    """
+    Stage durations (seconds) and counts of one query.
+    """
+
+    def __init__(self):
+        self.timings: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Time a block; a stage entered several times adds up.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name: str, value: int) -> None:
+        self.counts[name] = value
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    def metadata(self) -> Dict:
+        """
+        Timings in milliseconds, with the total time since the trace started.
+        """
+        timings = {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()}
+        timings['total'] = round(self.elapsed() * 1000, 3)
+        return {'timings_ms': timings, 'counts': dict(self.counts)}
+
+
+@contextmanager
+def profile_block(out: Dict, key: str = 'profile') -> Iterator[None]:
+    """
+    Run a block under cProfile and store the functions with the highest
+    cumulative time, as text, in out[key].
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        out[key] = text.getvalue()
+
+
+class SearchMetrics:
+    """
+    Counters of every query of an engine: queries and cache hits per search
+    type, a latency histogram, time spent in each stage and documents seen.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries: Counter = Counter()
+        self.cache_hits: Counter = Counter()
+        self.latency_buckets: Dict[str, list] = {}
+        self.latency_sum: Counter = Counter()
+        self.stage_seconds: Counter = Counter()
+        self.stage_calls: Counter = Counter()
+        self.documents: Counter = Counter()
+
+    def record(self, search_type: str, trace: QueryTrace, cached: bool) -> None:
+        latency = trace.elapsed()
+        with self._lock:
+            self.queries[search_type] += 1
+            if cached:
+                self.cache_hits[search_type] += 1
+            buckets = self.latency_buckets.setdefault(search_type, [0] * len(LATENCY_BUCKETS))
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if latency <= bound:
+                    buckets[i] += 1
+            self.latency_sum[search_type] += latency
+            for stage, seconds in trace.timings.items():
+                self.stage_seconds[stage] += seconds
+                self.stage_calls[stage] += 1
+            self.documents.update(trace.counts)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'queries': dict(self.queries),
+                'cache_hits': dict(self.cache_hits),
+                'latency': {search_type: {'buckets': dict(zip(map(str, LATENCY_BUCKETS), buckets)),
+                                          'sum_seconds': self.latency_sum[search_type],
+                                          'count': self.queries[search_type]}
+                            for search_type, buckets in self.latency_buckets.items()},
+                'stage_seconds': dict(self.stage_seconds),
+                'stage_calls': dict(self.stage_calls),
+                'documents': dict(self.documents),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self, prefix: str = 'search') -> str:
+        """
+        Counters in the Prometheus text exposition format.
+        """
+        metrics = self.to_dict()
+        lines = [f'# TYPE {prefix}_queries_total counter']
+        lines += [f'{prefix}_queries_total{{search_type="{t}"}} {n}' for t, n in metrics['queries'].items()]
+        lines.append(f'# TYPE {prefix}_cache_hits_total counter')
+        lines += [f'{prefix}_cache_hits_total{{search_type="{t}"}} {n}' for t, n in metrics['cache_hits'].items()]
+        lines.append(f'# TYPE {prefix}_latency_seconds histogram')
+        for search_type, latency in metrics['latency'].items():
+            for bound, count in latency['buckets'].items():
+                lines.append(f'{prefix}_latency_seconds_bucket{{search_type="{search_type}",le="{bound}"}} {count}')
+            lines.append(f'{prefix}_latency_seconds_bucket{{search_type="{search_type}",le="+Inf"}} {latency["count"]}')
+            lines.append(f'{prefix}_latency_seconds_sum{{search_type="{search_type}"}} {latency["sum_seconds"]}')
+            lines.append(f'{prefix}_latency_seconds_count{{search_type="{search_type}"}} {latency["count"]}')
+        lines.append(f'# TYPE {prefix}_stage_seconds_total counter')
+        lines += [f'{prefix}_stage_seconds_total{{stage="{s}"}} {v}' for s, v in metrics['stage_seconds'].items()]
+        lines.append(f'# TYPE {prefix}_stage_calls_total counter')
+        lines += [f'{prefix}_stage_calls_total{{stage="{s}"}} {v}' for s, v in metrics['stage_calls'].items()]
+        lines.append(f'# TYPE {prefix}_documents_total counter')
+        lines += [f'{prefix}_documents_total{{kind="{k}"}} {v}' for k, v in metrics['documents'].items()]
+        return '\n'.join(lines) + '\n'
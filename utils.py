@@ -13,91 +13,287 @@
 
 
 import json
+import threading
 import time
 import urllib.request
+from collections import OrderedDict
+from html.parser import HTMLParser
 from urllib.robotparser import RobotFileParser
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urldefrag, urljoin, urlparse
 import requests
 import xml.etree.ElementTree as ET
+from index_format import open_index
+
+def read_robots(url, session=None):
+    """
+    Télécharge et analyse le robots.txt de l'hôte de l'URL.
+    Mêmes règles que RobotFileParser.read : 401/403 interdit tout, autre erreur autorise tout.
+    """
+    rp = RobotFileParser(urllib.request.urljoin(url, '/robots.txt'))
+    try:
+        response = (session or requests).get(rp.url, timeout=10)
+    except requests.exceptions.RequestException:
+        rp.allow_all = True
+        return rp
+    if response.status_code in (401, 403):
+        rp.disallow_all = True
+    elif response.status_code >= 400:
+        rp.allow_all = True
+    else:
+        rp.parse(response.text.splitlines())
+    return rp
 
-def can_fetch(url, user_agent='*'):
-    rp = RobotFileParser()
-    rp.set_url(urllib.request.urljoin(url, '/robots.txt'))
-    rp.read()
-    return rp.can_fetch(user_agent, url)
 
-def get_urls(start_url):
+class RobotsCache:
     """
-    Extract all valid URLs from the given web page.
+    Cache des robots.txt par hôte, partagé par les boucles de crawl.
 
-    Args:
-        start_url (str): The URL of the page to extract links from.
+    Une entrée expire après `ttl` secondes ; au-delà de `max_hosts` hôtes, le
+    moins récemment utilisé est évincé. Les compteurs hits / misses / evictions
+    permettent de vérifier l'efficacité du cache (voir stats()).
+    """
 
-    Returns:
-        list: A list of valid and absolute URLs found on the page.
+    def __init__(self, ttl=3600, max_hosts=1024):
+        self.ttl = ttl
+        self.max_hosts = max_hosts
+        self._entries = OrderedDict()  # "scheme://hôte" -> (RobotFileParser, date de chargement)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _host_key(url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def get_cached(self, url):
+        """Retourne le robots.txt en cache s'il est encore valide, sans rien télécharger."""
+        key = self._host_key(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl:
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get(self, url, session=None):
+        """Retourne le robots.txt de l'hôte de l'URL, en le téléchargeant si besoin."""
+        rp = self.get_cached(url)
+        if rp is not None:
+            return rp
+
+        rp = read_robots(url, session)
+        key = self._host_key(url)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = (rp, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_hosts:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return rp
+
+    def can_fetch(self, url, user_agent='*', session=None):
+        return self.get(url, session).can_fetch(user_agent, url)
+
+    def crawl_delay(self, url, user_agent='*', session=None):
+        return self.get(url, session).crawl_delay(user_agent)
+
+    def stats(self):
+        with self._lock:
+            return {"hosts": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+# Cache partagé par défaut (crawl séquentiel et crawl asynchrone)
+ROBOTS_CACHE = RobotsCache()
+
+
+def can_fetch(url, user_agent='*', cache=None):
+    return (cache or ROBOTS_CACHE).can_fetch(url, user_agent)
+
+# Parseurs HTML disponibles, du plus rapide au plus lent (html.parser est toujours là)
+try:
+    from selectolax.parser import HTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+class _PageParser(HTMLParser):
+    """
+    Parseur en une seule passe (bibliothèque standard) : récupère le titre, la
+    description produit, le premier paragraphe et les href des liens.
     """
-    try:
-        response = requests.get(start_url, timeout=10)
-        response.raise_for_status()  # Raise an HTTPError if the HTTP request returned an unsuccessful status code
-        soup = BeautifulSoup(response.text, 'html.parser')
 
-        base_url = start_url # Filter to stay within this domain
-        links = set()
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = None
+        self.product_description = None
+        self.first_paragraph = None
+        self.hrefs = []
+        self._title_parts = None
+        self._first_started = False
+        self._paragraphs = []  # paragraphes ouverts : [premier ?, description ?, morceaux de texte]
 
-        for tag in soup.find_all("a", href=True):
-            href = tag["href"]
-            absolute_url = urljoin(start_url, href)
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href is not None:
+                self.hrefs.append(href)
+        elif tag == "title" and self.title is None and self._title_parts is None:
+            self._title_parts = []
+        elif tag == "p":
+            classes = (dict(attrs).get("class") or "").split()
+            is_first = not self._first_started
+            is_description = self.product_description is None and "product-description" in classes
+            self._first_started = True
+            self._paragraphs.append([is_first, is_description, []])
 
-            # Ensure the link belongs to the same domain and is not external
-            if urlparse(absolute_url).netloc == urlparse(base_url).netloc:
-                links.add(absolute_url)
+    def handle_endtag(self, tag):
+        if tag == "title" and self._title_parts is not None:
+            self.title = "".join(self._title_parts)
+            self._title_parts = None
+        elif tag == "p" and self._paragraphs:
+            self._close_paragraph()
 
-        return list(links)
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+        for paragraph in self._paragraphs:
+            if paragraph[0] or paragraph[1]:
+                paragraph[2].append(data)
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error fetching {start_url}: {e}")
-        return []
+    def _close_paragraph(self):
+        is_first, is_description, parts = self._paragraphs.pop()
+        text = "".join(parts).strip()
+        if is_first:
+            self.first_paragraph = text
+        if is_description and self.product_description is None:
+            self.product_description = text
 
+    def close(self):
+        super().close()
+        while self._paragraphs:
+            self._close_paragraph()
 
 
-def extract_page_data(url):
-    try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+def _parse_with_html_parser(response):
+    parser = _PageParser()
+    parser.feed(response.text)
+    parser.close()
+    return parser.title, parser.product_description, parser.first_paragraph, parser.hrefs
+
+
+def _parse_with_lxml(response):
+    document = lxml.html.fromstring(response.content)
+    title = document.findtext(".//title")
+    description = document.xpath(
+        '//p[contains(concat(" ", normalize-space(@class), " "), " product-description ")]')
+    paragraph = document.find(".//p")
+    return (title,
+            description[0].text_content().strip() if description else None,
+            paragraph.text_content().strip() if paragraph is not None else None,
+            document.xpath("//a/@href"))
 
-        # Extraire le titre
-        title = soup.title.string.strip() if soup.title else "Pas de titre"
 
-        # Extraire la description du produit (si disponible)
-        product_description_tag = soup.find('p', class_="product-description")
-        product_description = product_description_tag.get_text().strip() if product_description_tag else ""
+def _parse_with_selectolax(response):
+    tree = SelectolaxParser(response.content)
+    title = tree.css_first("title")
+    description = tree.css_first("p.product-description")
+    paragraph = tree.css_first("p")
+    return (title.text() if title is not None else None,
+            description.text().strip() if description is not None else None,
+            paragraph.text().strip() if paragraph is not None else None,
+            [node.attributes.get("href") for node in tree.css("a[href]")])
 
-        # Extraire le premier paragraphe (si pas de description produit)
-        first_paragraph_tag = soup.find('p')
-        first_paragraph = first_paragraph_tag.get_text().strip() if first_paragraph_tag else ""
 
-        # Extraction des liens
-        links = set()
-        for tag in soup.find_all("a", href=True):
-            href = tag["href"]
-            absolute_url = urljoin(url, href)
+PARSER_BACKENDS = {"html.parser": _parse_with_html_parser}
+if lxml is not None:
+    PARSER_BACKENDS["lxml"] = _parse_with_lxml
+if SelectolaxParser is not None:
+    PARSER_BACKENDS["selectolax"] = _parse_with_selectolax
 
-            # S'assurer que le lien appartient au même domaine
-            if urlparse(absolute_url).netloc == urlparse(url).netloc:
-                links.add(absolute_url)
+# Parseur utilisé par défaut : le plus rapide qui est installé
+DEFAULT_PARSER = next(name for name in ("selectolax", "lxml", "html.parser") if name in PARSER_BACKENDS)
 
-        return {
-            "title": title,
-            "url": url,
-            "first_paragraph": product_description if product_description else first_paragraph,
-            "links": list(links)  # Convertir en liste
-        }
 
+def normalize_links(page_url, hrefs):
+    """
+    Rend les liens absolus, retire les ancres (#...) et ne garde que ceux du même domaine.
+    """
+    netloc = urlparse(page_url).netloc
+    links = set()
+    for href in hrefs:
+        if href is None:
+            continue
+        absolute_url, _ = urldefrag(urljoin(page_url, href))
+        if urlparse(absolute_url).netloc == netloc:
+            links.add(absolute_url)
+    return list(links)
+
+
+def fetch_and_extract(url, session=None, parser=None):
+    """
+    Télécharge une page une seule fois et l'analyse une seule fois.
+
+    Args:
+        url (str): L'URL de la page.
+        session (requests.Session, optionnel): Session partagée (pool de connexions).
+        parser (str, optionnel): "selectolax", "lxml" ou "html.parser" (DEFAULT_PARSER sinon).
+
+    Returns:
+        dict or None: titre, description produit, premier paragraphe (la description
+                      produit si elle existe) et liens internes normalisés.
+    """
+    try:
+        response = (session or requests).get(url, timeout=10)
+        response.raise_for_status()
     except requests.exceptions.RequestException as e:
         print(f"Erreur lors de l'extraction des données de {url}: {e}")
         return None
+
+    title, product_description, first_paragraph, hrefs = \
+        PARSER_BACKENDS[parser or DEFAULT_PARSER](response)
+    product_description = product_description or ""
+
+    return {
+        "title": title.strip() if title is not None else "Pas de titre",
+        "url": url,
+        "description": product_description,
+        "first_paragraph": product_description if product_description else (first_paragraph or ""),
+        "links": normalize_links(url, hrefs)
+    }
+
+
+def get_urls(start_url, session=None):
+    """
+    Extract all valid URLs from the given web page.
+
+    Args:
+        start_url (str): The URL of the page to extract links from.
+
+    Returns:
+        list: A list of valid and absolute URLs found on the page.
+    """
+    page_data = fetch_and_extract(start_url, session)
+    return page_data["links"] if page_data else []
+
+
+def extract_page_data(url, session=None):
+    """
+    Télécharge une page et en extrait le titre, le premier paragraphe et les liens internes.
+
+    Args:
+        url (str): L'URL de la page.
+        session (requests.Session, optionnel): Session partagée (pool de connexions).
+    """
+    return fetch_and_extract(url, session)
     
 
 def load_data(file_path):
@@ -111,7 +307,6 @@ def load_data(file_path):
 
 
 def load_index(index_path):
-    """Charge un index depuis un fichier JSON."""
-    with open(index_path, "r", encoding="utf-8") as file:
-        return json.load(file)
+    """Charge un index depuis un fichier JSON, ou le projette en mémoire s'il est binaire (.bin)."""
+    return open_index(index_path)
 